@@ -0,0 +1,110 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+
+# Entries that haven't been used for this long are dropped, and once the cache holds
+# more than MAX_SIZE bytes of bodies the least recently used entries are dropped.
+TTL_SECONDS = 30 * 24 * 60 * 60
+MAX_SIZE = 100 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Entry:
+    etag: str
+    body: str
+    next_url: str | None
+
+
+class ResponseCache:
+    """
+    A persistent cache of REST API responses, for making conditional requests
+
+    We store each response's ETag alongside its body, so that the next time we request
+    the same URL we can send If-None-Match.  If nothing has changed, GitHub responds
+    with 304 Not Modified, which doesn't count against our rate limit, and we use the
+    body from the cache.  Entries are keyed by a hash of the token and the URL, because
+    different tokens can see different responses from the same URL, and we don't want
+    tokens in the cache.
+    """
+
+    def __init__(self, path, ttl=TTL_SECONDS, max_size=MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    next_url TEXT,
+                    size INTEGER NOT NULL,
+                    used_at REAL NOT NULL
+                )
+                """
+            )
+
+    def get(self, token, url):
+        key = _key(token, url)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT etag, body, next_url, used_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            etag, body, next_url, used_at = row
+            if used_at < time.time() - self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            return Entry(etag, body, next_url)
+
+    def touch(self, token, url):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE responses SET used_at = ? WHERE key = ?",
+                (time.time(), _key(token, url)),
+            )
+
+    def put(self, token, url, entry):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    _key(token, url),
+                    entry.etag,
+                    entry.body,
+                    entry.next_url,
+                    len(entry.body),
+                    time.time(),
+                ),
+            )
+            self._evict()
+
+    def _evict(self):
+        self._db.execute(
+            "DELETE FROM responses WHERE used_at < ?", (time.time() - self.ttl,)
+        )
+        self._db.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY used_at DESC, key) AS total
+                    FROM responses
+                )
+                WHERE total > ?
+            )
+            """,
+            (self.max_size,),
+        )
+
+
+def _key(token, url):
+    return hashlib.sha256(f"{token} {url}".encode()).hexdigest()
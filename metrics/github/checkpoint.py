@@ -0,0 +1,125 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+
+# A run can only be resumed for this long after it started fetching a query, so that
+# we never replay pages that are out of date.
+TTL_SECONDS = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    pages: int
+    position: str | None
+    done: bool
+
+
+class CheckpointStore:
+    """
+    A persistent record of the pages of each query that we've fetched so far in a run
+
+    We record each page of a query's nodes as we get it, along with the position (a
+    GraphQL cursor or a REST URL) of the next page, or that there are no more pages.  If
+    a run fails, the next run can replay the pages that we've already fetched from the
+    store and carry on from the next position, rather than starting again from scratch.
+
+    Queries are keyed by a hash of everything that identifies them, except the token.
+    """
+
+    def __init__(self, path, ttl=TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    key TEXT PRIMARY KEY,
+                    pages INTEGER NOT NULL,
+                    position TEXT,
+                    done INTEGER NOT NULL,
+                    started_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    nodes TEXT NOT NULL,
+                    PRIMARY KEY (key, page)
+                )
+                """
+            )
+
+    def get(self, query):
+        key = _key(query)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT pages, position, done, started_at FROM checkpoints WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            pages, position, done, started_at = row
+            if started_at < time.time() - self.ttl:
+                self._db.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+                self._db.execute("DELETE FROM pages WHERE key = ?", (key,))
+                return None
+
+            return Checkpoint(pages, position, bool(done))
+
+    def nodes(self, query, checkpoint):
+        """
+        Yield the nodes from the pages recorded in a checkpoint, a page at a time
+        """
+        key = _key(query)
+        for page in range(checkpoint.pages):
+            with self._lock:
+                (nodes,) = self._db.execute(
+                    "SELECT nodes FROM pages WHERE key = ? AND page = ?", (key, page)
+                ).fetchone()
+            yield from json.loads(nodes)
+
+    def add_page(self, query, nodes, position):
+        """
+        Record the next page of a query's nodes, and the position of the page after it
+
+        A position of None means that there are no more pages.
+        """
+        key = _key(query)
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT pages, started_at FROM checkpoints WHERE key = ?", (key,)
+            ).fetchone()
+            page, started_at = row if row else (0, time.time())
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                (key, page, json.dumps(nodes)),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                (key, page + 1, position, position is None, started_at),
+            )
+
+    def delete(self, query):
+        key = _key(query)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM pages WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM checkpoints")
+            self._db.execute("DELETE FROM pages")
+
+
+def _key(query):
+    encoded = json.dumps(query, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
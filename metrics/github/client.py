@@ -1,67 +1,105 @@
 import json
-import os
 import textwrap
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 import requests
+import requests.adapters
 import requests.utils
-import requests_cache
 import structlog
 
+from metrics.github.cache import Entry
+
 
 log = structlog.get_logger()
 
-# See DEVELOPERS.md
-if "DEBUG_CACHE" in os.environ:
-    requests_cache.install_cache(
-        "github-cache",
-        # Turn on caching for POST requests because that's what GraphQL uses
-        allowable_methods=("GET", "HEAD", "POST"),
-    )
+# We fetch from several repos at once, but GitHub's secondary rate limits penalise
+# making too many concurrent requests with the same token, so we cap those separately.
+MAX_WORKERS = 8
+MAX_REQUESTS_PER_TOKEN = 4
+
+# When we're rate limited we retry a few times, backing off exponentially from
+# BACKOFF_SECONDS unless GitHub tells us how long to wait.
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2
 
-session = requests.Session()
+# Once a token has fewer than this many requests left before its budget resets, we
+# start spreading those requests out over the time until the reset.
+PACING_THRESHOLD = 500
 
 
 class GitHubClient:
-    def __init__(self, token=None, tokens=None):
+    """
+    A client for GitHub's REST and GraphQL APIs
+
+    A single client is meant to be shared by everything in a run, including callers
+    on different threads, so that they share its connection pool, its view of our
+    rate limits, and its limits on concurrent requests.
+    """
+
+    def __init__(
+        self,
+        token=None,
+        tokens=None,
+        cache=None,
+        checkpoints=None,
+        resume=False,
+        max_requests_per_token=MAX_REQUESTS_PER_TOKEN,
+    ):
         assert token or tokens
         assert not (token and tokens)
         self.token = token
         self.tokens = tokens
+        self.cache = cache
+        self.checkpoints = checkpoints
+        self.resume = resume
+        self.max_requests_per_token = max_requests_per_token
+        self.rate_limits = RateLimits()
+        # we make at most max_requests_per_token requests at once with each token
+        token_count = len(set(tokens.values())) if tokens else 1
+        self.session = _session(token_count * max_requests_per_token)
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
 
-    def graphql_query(self, query, path, **kwargs):
-        def extract(data):
-            result = data
-            for key in path:
-                try:
-                    result = result[key]
-                except TypeError as e:
-                    e.add_note(f"Couldn't find {path} in {data}")
-                    raise
-            return result
-
-        more_pages = True
-        cursor = None
-        while more_pages:
-            page = extract(
-                self.graphql_query_page(query=query, cursor=cursor, **kwargs)
+    def graphql_query(self, query, path, cursor=None, **kwargs):
+        def get_page(cursor):
+            page = _extract(
+                self.graphql_query_page(query=query, cursor=cursor, **kwargs), path
             )
-            yield from page["nodes"]
             more_pages = page["pageInfo"]["hasNextPage"]
-            cursor = page["pageInfo"]["endCursor"]
+            return page["nodes"], page["pageInfo"]["endCursor"] if more_pages else None
 
-    def rest_query(self, path, **variables):
-        headers = self._get_headers(variables)
+        key = ("graphql", query, path, cursor, kwargs)
+        yield from self._paginate(key, cursor, get_page)
 
-        more_pages = True
-        url = f"https://api.github.com{path.format(**variables)}"
+    def graphql_query_pages(self, query, paths, **kwargs):
+        """
+        Get the first page of each of several connections in a single query
+
+        The query is expected to select each connection under a different alias;
+        paths maps each alias to the path of its connection, and the pages are
+        returned in a dict with the same keys.
+        """
 
-        while more_pages:
-            response = requests.get(url, headers=headers)
-            check_response(response)
+        def get_page(_):
+            data = self.graphql_query_page(query=query, cursor=None, **kwargs)
+            pages = {alias: _extract(data, path) for alias, path in paths.items()}
+            return [pages], None
 
-            data = response.json()
+        key = ("graphql_pages", query, paths, kwargs)
+        (pages,) = self._paginate(key, None, get_page)
+        return pages
+
+    def rest_query(self, path, **variables):
+        token = self._get_token(variables)
+
+        def get_page(url):
+            data, next_url = self._get_json(url, token)
             if isinstance(data, list):
-                yield from data
+                return data, next_url
 
             # Unlike the team repositories endpoint or the team members endpoint,
             # which return arrays of the objects we're interested in,
@@ -69,11 +107,41 @@ class GitHubClient:
             # This object has a codespaces key,
             # whose value is an array of the objects we're interested in.
             elif "codespaces" in path and isinstance(data, dict):
-                yield from data["codespaces"]
+                return data["codespaces"], next_url
             else:
                 raise RuntimeError("Unexpected response format:", data)
 
-            more_pages, url = check_for_next_page(response)
+        url = f"https://api.github.com{path.format(**variables)}"
+        yield from self._paginate(("rest", path, variables), url, get_page)
+
+    def _paginate(self, key, position, get_page):
+        """
+        Yield the nodes from each page of a query in turn
+
+        get_page takes the position of a page and returns its nodes and the position of
+        the next page, or None if there are no more pages.  If we have a checkpoint
+        store then we record each page as we get it.  If we're resuming a run that
+        failed part way through, and the store has some of the query's pages, then we
+        replay them and carry on from where they left off.  Otherwise we start the
+        query's checkpoint again.  See DEVELOPERS.md.
+        """
+        if self.checkpoints:
+            checkpoint = self.checkpoints.get(key) if self.resume else None
+            if checkpoint:
+                yield from self.checkpoints.nodes(key, checkpoint)
+                if checkpoint.done:
+                    return
+                position = checkpoint.position
+            else:
+                self.checkpoints.delete(key)
+
+        while True:
+            nodes, position = get_page(position)
+            if self.checkpoints:
+                self.checkpoints.add_page(key, nodes, position)
+            yield from nodes
+            if position is None:
+                return
 
     def graphql_query_page(self, query, cursor, **kwargs):
         """
@@ -87,10 +155,10 @@ class GitHubClient:
         [1]: https://graphql.org/learn/pagination/#end-of-list-counts-and-connections
         """
         variables = {"cursor": cursor, **kwargs}
-        headers = self._get_headers(variables)
-        response = session.post(
+        response = self._send(
+            "POST",
             "https://api.github.com/graphql",
-            headers=headers,
+            self._get_token(variables),
             json={"query": query, "variables": variables},
         )
 
@@ -113,16 +181,219 @@ class GitHubClient:
 
         return results["data"]
 
-    def _get_headers(self, variables):
+    def _get_token(self, variables):
         if self.token:
-            token = self.token
-        else:
-            token = self.tokens[variables["org"]]
-        headers = {
-            "Authorization": f"bearer {token}",
-            "User-Agent": "Bennett Metrics",
-        }
-        return headers
+            return self.token
+        return self.tokens[variables["org"]]
+
+    def _get_json(self, url, token):
+        """
+        Get the decoded body of a REST response, and the URL of its next page (if any)
+
+        If we have the response cached, we make a conditional request and use the
+        cached copy if it hasn't changed.
+        """
+        cached = self.cache.get(token, url) if self.cache else None
+        headers = {"If-None-Match": cached.etag} if cached else {}
+
+        response = self._send("GET", url, token, headers=headers)
+        if cached and response.status_code == 304:
+            self.cache.touch(token, url)
+            return json.loads(cached.body), cached.next_url
+
+        check_response(response)
+        _, next_url = check_for_next_page(response)
+        if self.cache and "ETag" in response.headers:
+            self.cache.put(
+                token, url, Entry(response.headers["ETag"], response.text, next_url)
+            )
+        return response.json(), next_url
+
+    def _send(self, method, url, token, headers=None, **kwargs):
+        """
+        Make a request, waiting for rate limits and retrying if we're rate limited
+
+        Retrying a single request like this means that we never lose our place in the
+        pages of results that we're working through.
+        """
+        resource = "graphql" if url.endswith("/graphql") else "core"
+        attempt = 0
+        while True:
+            time.sleep(self.rate_limits.delay(token, resource))
+            with self._semaphore(token):
+                response = self.session.request(
+                    method,
+                    url,
+                    headers={**_headers(token), **(headers or {})},
+                    **kwargs,
+                )
+            self.rate_limits.update(token, response)
+
+            delay = _retry_delay(response, attempt)
+            if delay is None:
+                return response
+
+            log.info(
+                "Retrying request",
+                url=url,
+                status=response.status_code,
+                attempt=attempt,
+                delay=delay,
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _semaphore(self, token):
+        """
+        Get the semaphore which limits the number of concurrent requests for a token
+        """
+        with self._semaphores_lock:
+            if token not in self._semaphores:
+                self._semaphores[token] = threading.BoundedSemaphore(
+                    self.max_requests_per_token
+                )
+            return self._semaphores[token]
+
+
+def _extract(data, path):
+    result = data
+    for key in path:
+        try:
+            result = result[key]
+        except TypeError as e:
+            e.add_note(f"Couldn't find {path} in {data}")
+            raise
+    return result
+
+
+def concurrently(func, args, max_workers=MAX_WORKERS):
+    """
+    Call func(*a) for each a in args on a pool of threads
+
+    Results are yielded as lists, in the same order as args, whatever order the calls
+    finish in, so callers see exactly what they would if they'd made the calls one
+    after another.  Materialising each result on its worker thread means that any
+    pagination loop inside func runs concurrently too.  At most max_workers results
+    are in flight or waiting to be yielded, which keeps memory bounded when the
+    caller consumes them slowly.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for a in args:
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(lambda a: list(func(*a)), a))
+
+        while pending:
+            yield pending.popleft().result()
+
+
+@dataclass
+class _Budget:
+    remaining: int
+    reset: float
+    next_request: float = 0
+
+
+class RateLimits:
+    """
+    Track the rate limit budget that GitHub reports for each token and pace requests
+    so that we don't exhaust it before it resets
+
+    GitHub reports the budget in the X-RateLimit-* headers of every response, for both
+    the REST and GraphQL APIs, but the two APIs have separate budgets.
+    """
+
+    def __init__(self):
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def update(self, token, response):
+        try:
+            resource = response.headers["X-RateLimit-Resource"]
+            remaining = int(response.headers["X-RateLimit-Remaining"])
+            reset = int(response.headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self._lock:
+            budget = self._budgets.get((token, resource))
+            if budget is None or budget.reset != reset:
+                self._budgets[(token, resource)] = _Budget(remaining, reset)
+            else:
+                budget.remaining = min(budget.remaining, remaining)
+
+    def delay(self, token, resource):
+        """
+        Get the number of seconds to wait before making a request with a token
+        """
+        with self._lock:
+            budget = self._budgets.get((token, resource))
+            now = time.time()
+            if budget is None or budget.reset <= now:
+                return 0
+            if budget.remaining <= 0:
+                return budget.reset - now
+
+            # We count the request that we're about to make against the budget, so
+            # that concurrent requests see what will be left.
+            budget.remaining -= 1
+            if budget.remaining >= PACING_THRESHOLD:
+                return 0
+
+            start = max(now, budget.next_request)
+            budget.next_request = start + (budget.reset - start) / (
+                budget.remaining + 1
+            )
+            return start - now
+
+
+def _retry_delay(response, attempt):
+    """
+    Get the number of seconds to wait before retrying a request, or None if we
+    shouldn't retry it
+    """
+    if response.ok or attempt >= MAX_RETRIES:
+        return None
+
+    backoff = BACKOFF_SECONDS * 2**attempt
+    if response.status_code in (403, 429):
+        if "Retry-After" in response.headers:
+            return int(response.headers["Retry-After"])
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = int(response.headers["X-RateLimit-Reset"])
+            return max(reset - time.time(), 0) + 1
+        # GitHub uses 403 for both secondary rate limits and permissions errors, so
+        # we have to look at the message to tell them apart.
+        if response.status_code == 429 or "rate limit" in response.text.lower():
+            return backoff
+        return None
+
+    if response.status_code >= 500:
+        return backoff
+
+    return None
+
+
+def _session(pool_size):
+    """
+    Make a session whose connection pool is big enough for our concurrent requests
+
+    All our requests go to the same host, so we only need one pool, but it needs to
+    hold a connection for each request that we make at once so that we keep those
+    connections alive.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def _headers(token):
+    return {
+        "Authorization": f"bearer {token}",
+        "User-Agent": "Bennett Metrics",
+    }
 
 
 def check_response(response):
@@ -1,8 +1,15 @@
 import datetime
+import functools
+import itertools
+import os
+import sys
+import threading
 from dataclasses import dataclass
 
-from metrics.github import query
+from metrics.github import query, sync
+from metrics.github.client import concurrently
 from metrics.tools.dates import date_from_iso
+from metrics.tools.iter import batched
 
 
 # Slugs (not names!) of the GitHub entities we're interested in
@@ -26,7 +33,7 @@ _MANAGERS = {"sebbacon", "benbc"}
 _EX_DEVELOPERS = {"ghickman", "milanwiedemann", "CarolineMorton"}
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Repo:
     org: str
     name: str
@@ -46,16 +53,16 @@ class Repo:
     @classmethod
     def from_dict(cls, data, org, team):
         return cls(
-            org,
-            data["name"],
-            team,
+            sys.intern(org),
+            sys.intern(data["name"]),
+            sys.intern(team) if team else team,
             date_from_iso(data["createdAt"]),
             data["archivedAt"] is not None,
             data["hasVulnerabilityAlertsEnabled"],
         )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class PR:
     repo: Repo
     author: str
@@ -78,7 +85,7 @@ class PR:
 
     @classmethod
     def from_dict(cls, data, repo, tech_team_members):
-        author = data["author"]["login"]
+        author = sys.intern(data["author"]["login"])
         is_content = repo.is_content_repo and author not in tech_team_members
 
         return cls(
@@ -91,7 +98,7 @@ class PR:
         )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Issue:
     repo: Repo
     author: str
@@ -102,13 +109,13 @@ class Issue:
     def from_dict(cls, data, repo):
         return cls(
             repo,
-            data["author"]["login"],
+            sys.intern(data["author"]["login"]),
             date_from_iso(data["createdAt"]),
             date_from_iso(data["closedAt"]),
         )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Codespace:
     org: str
     repo_name: str
@@ -119,9 +126,9 @@ class Codespace:
     @classmethod
     def from_dict(cls, data, org):
         return cls(
-            org=org,
-            repo_name=data["repository"]["name"],
-            user=data["owner"]["login"],
+            org=sys.intern(org),
+            repo_name=sys.intern(data["repository"]["name"]),
+            user=sys.intern(data["owner"]["login"]),
             created_at=data["created_at"],
             last_used_at=data["last_used_at"],
         )
@@ -134,21 +141,65 @@ def codespaces(org):
     ]
 
 
-def tech_prs():
+def tech_prs(incremental=False):
+    """
+    Get the PRs from all the tech-owned repos
+
+    If incremental is True then we only fetch the PRs that have changed since we last
+    fetched them, and get the rest from the database.
+    """
+    return [pr for _, prs in iter_tech_prs(incremental) for pr in prs]
+
+
+def iter_tech_prs(incremental=False):
+    """
+    Yield (repo, PRs) for each of the tech-owned repos, like tech_prs
+
+    We fetch the repos' PRs as they're needed, so callers that deal with one repo at a
+    time only hold a few repos' PRs in memory at once.
+    """
     tech_team_members = _tech_team_members()
-    return [
-        PR.from_dict(pr, repo, tech_team_members)
-        for repo in tech_repos()
-        for pr in query.prs(repo.org, repo.name)
-    ]
+    repos = tech_repos()
+    if incremental:
+        # replaying a snapshot doesn't touch the PR store
+        if "GITHUB_FROM_SNAPSHOT" not in os.environ:
+            sync.prepare(repos)
+        fetch = sync.prs_for_repos
+    else:
+        fetch = query.prs_for_repos
+    for repo, prs in for_each_repo(fetch, repos):
+        yield repo, [PR.from_dict(pr, repo, tech_team_members) for pr in prs]
 
 
 def tech_issues():
-    return [
-        Issue.from_dict(i, repo)
-        for repo in tech_repos()
-        for i in query.issues(repo.org, repo.name)
+    return [issue for _, issues in iter_tech_issues() for issue in issues]
+
+
+def iter_tech_issues():
+    """
+    Yield (repo, issues) for each of the tech-owned repos, like iter_tech_prs
+    """
+    for repo, issues in for_each_repo(query.issues_for_repos, tech_repos()):
+        yield repo, [Issue.from_dict(i, repo) for i in issues]
+
+
+def for_each_repo(fetch, repos):
+    """
+    Yield (repo, nodes) for each repo, in order
+
+    fetch is one of the query.*_for_repos functions.  We call it with batches of repos
+    from the same org, and fetch the batches concurrently.
+    """
+    batches = [
+        batch
+        for _, org_repos in itertools.groupby(repos, lambda repo: repo.org)
+        for batch in batched(org_repos, query.BATCH_SIZE)
     ]
+    results = concurrently(
+        fetch, [(batch[0].org, [repo.name for repo in batch]) for batch in batches]
+    )
+    for batch, nodes_by_repo in zip(batches, results):
+        yield from zip(batch, nodes_by_repo)
 
 
 def tech_repos():
@@ -163,14 +214,14 @@ def _get_repos():
     repos = []
     for org in _ORGS:
         ownership = _repo_owners(org)
-        for repo in query.repos(org):
+        for repo in _org_repos(org):
             owner = ownership.get(repo["name"])
             repos.append(Repo.from_dict(repo, org, owner))
     return repos
 
 
 def _repo_owners(org):
-    return {repo: team for team in _TECH_TEAMS for repo in query.team_repos(org, team)}
+    return {repo: team for team in _TECH_TEAMS for repo in _team_repos(org, team)}
 
 
 def _tech_team_members():
@@ -181,6 +232,61 @@ def _tech_team_members():
             person
             for org in _ORGS
             for team in _TECH_TEAMS
-            for person in query.team_members(org, team)
+            for person in _team_members(org, team)
         }
     )
+
+
+# Several tasks run in the same process and each of them needs the repos and teams, so
+# we only fetch them once per org (and team) per run.  Call clear_cache() to fetch them
+# again.
+
+
+def _fetch_once(func):
+    """
+    Like functools.cache, but safe to call from several tasks' threads at once
+
+    The first caller for each set of arguments fetches the result while any others for
+    the same arguments wait for it, so that it's only fetched once.
+    """
+    results = {}
+    locks = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        with lock:
+            key_lock = locks.setdefault(args, threading.Lock())
+        with key_lock:
+            if args not in results:
+                results[args] = func(*args)
+            return results[args]
+
+    def cache_clear():
+        with lock:
+            results.clear()
+            locks.clear()
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+@_fetch_once
+def _org_repos(org):
+    return tuple(query.repos(org))
+
+
+@_fetch_once
+def _team_repos(org, team):
+    return tuple(query.team_repos(org, team))
+
+
+@_fetch_once
+def _team_members(org, team):
+    return frozenset(query.team_members(org, team))
+
+
+def clear_cache():
+    _org_repos.cache_clear()
+    _team_repos.cache_clear()
+    _team_members.cache_clear()
@@ -1,13 +1,27 @@
 import datetime
+import itertools
 from collections import defaultdict
 
-from metrics.github.github import PR
 from metrics.tools.dates import iter_days
 
 
-def get_pr_metrics(prs):
-    old_counts = calculate_pr_counts(prs, PR.was_old_on)
-    throughput_counts = calculate_pr_counts(prs, PR.was_merged_on)
+ONE_DAY = datetime.timedelta(days=1)
+ONE_WEEK = datetime.timedelta(weeks=1)
+
+
+def get_pr_metrics(prs, since=None, change_points=False):
+    """
+    Get the PR metrics for each day
+
+    If since is given then we only get the metrics for each repo from the day in since
+    for that repo onwards (see _counts_since).  If change_points is True then we only
+    get the old PR counts for the days on which they change (see _change_points).
+    """
+    old_counts = calculate_old_pr_counts(prs)
+    if change_points:
+        old_counts = _change_points(old_counts)
+    old_counts = _counts_since(old_counts, since)
+    throughput_counts = _counts_since(calculate_merged_pr_counts(prs), since)
 
     count_metrics = convert_pr_counts_to_metrics(old_counts, "queue_older_than_7_days")
     throughput_metrics = convert_pr_counts_to_metrics(throughput_counts, "prs_merged")
@@ -15,21 +29,175 @@ def get_pr_metrics(prs):
     return count_metrics + throughput_metrics
 
 
+def iter_pr_metrics(prs_by_repo, since=None, change_points=False):
+    """
+    Yield the PR metrics for each repo in turn, like get_pr_metrics
+
+    prs_by_repo is an iterable of (repo, PRs), like github.iter_tech_prs.  The metrics
+    are counted per repo, so we only need to hold one repo's PRs and metrics at a time.
+    """
+    for _, prs in prs_by_repo:
+        yield from get_pr_metrics(prs, since, change_points)
+
+
 def calculate_pr_counts(prs, predicate):
+    today = _today()
     counts = defaultdict(int)
     for pr in prs:
         start = pr.created_on
-        end = (
-            pr.closed_on
-            if pr.closed_on
-            else datetime.datetime.now(tz=datetime.UTC).date()
-        )
+        end = pr.closed_on if pr.closed_on else today
         for day in iter_days(start, end):
             if predicate(pr, day):
                 counts[(pr.repo.org, pr.repo.name, pr.author, pr.is_content, day)] += 1
     return dict(counts)
 
 
+def calculate_old_pr_counts(prs):
+    """
+    Count the PRs that were old on each day
+
+    This gives the same result as calculate_pr_counts(prs, PR.was_old_on), but rather
+    than asking every PR about every day of its life, we work out the days on which
+    each PR was old and count the overlapping intervals.
+    """
+    today = _today()
+    return _count_intervals(
+        (
+            coord,
+            created_on + ONE_WEEK,
+            closed_on - ONE_DAY if closed_on else today,
+        )
+        for coord, created_on, closed_on, _ in _pr_rows(prs)
+    )
+
+
+def calculate_merged_pr_counts(prs):
+    """
+    Count the PRs that were merged on each day
+
+    This gives the same result as calculate_pr_counts(prs, PR.was_merged_on).
+    """
+    today = _today()
+    counts = defaultdict(int)
+    for coord, created_on, closed_on, merged_on in _pr_rows(prs):
+        end = closed_on if closed_on else today
+        if merged_on and created_on <= merged_on <= end:
+            counts[(*coord, merged_on)] += 1
+    return dict(counts)
+
+
+def _pr_rows(prs):
+    """
+    Yield (coord, created_on, closed_on, merged_on) for each PR
+    """
+    return ((_pr_coord(pr), pr.created_on, pr.closed_on, pr.merged_on) for pr in prs)
+
+
+def _pr_coord(pr):
+    return pr.repo.org, pr.repo.name, pr.author, pr.is_content
+
+
+def _count_intervals(intervals):
+    """
+    Count the intervals that include each day, for each coordinate
+
+    intervals is an iterable of (coord, first_day, last_day).  We record where each
+    interval starts and ends, and then sweep through those changes in date order,
+    keeping a running count.  This means that the work we do is proportional to the
+    number of intervals plus the number of days with non-zero counts, rather than to
+    the total length of all the intervals.  Days with a count of zero are omitted.
+    """
+    changes = defaultdict(lambda: defaultdict(int))
+    for coord, first_day, last_day in intervals:
+        if first_day <= last_day:
+            changes[coord][first_day] += 1
+            changes[coord][last_day + ONE_DAY] -= 1
+
+    counts = {}
+    for coord, coord_changes in changes.items():
+        count = 0
+        for day, next_change in itertools.pairwise(sorted(coord_changes)):
+            count += coord_changes[day]
+            if count:
+                for d in iter_days(day, next_change - ONE_DAY):
+                    counts[(*coord, d)] = count
+    return counts
+
+
+def _counts_since(counts, since):
+    """
+    Keep the counts for the days from the day in since for each repo onwards
+
+    since maps (org, repo) to a date, and counts' keys start with the org and repo and
+    end with the day.  Repos that aren't in since keep all of their counts.  This lets
+    us recompute only the days that can have changed since we last stored the metrics.
+    """
+    if since is None:
+        return counts
+    return {
+        coord: count
+        for coord, count in counts.items()
+        if coord[-1] >= since.get(coord[:2], datetime.date.min)
+    }
+
+
+def _change_points(counts):
+    """
+    Keep the counts for the days on which they change
+
+    counts' keys end with the day, and the days on which a count is zero are omitted.
+    We keep each coordinate's count on the first day that it has one, and on each day
+    that it changes after that.  When a count drops to zero we keep a zero on that day,
+    so that carrying each count forward (as the *-locf.sql queries do) gives back the
+    count on every day.
+    """
+    today = _today()
+    days = defaultdict(list)
+    for coord in counts:
+        days[coord[:-1]].append(coord[-1])
+
+    changes = {}
+    for coord, coord_days in days.items():
+        previous_day = previous_count = None
+        for day in sorted(coord_days):
+            count = counts[(*coord, day)]
+            if previous_day is not None and day != previous_day + ONE_DAY:
+                changes[(*coord, previous_day + ONE_DAY)] = 0
+                previous_count = 0
+            if count != previous_count:
+                changes[(*coord, day)] = count
+            previous_day, previous_count = day, count
+        if previous_day < today:
+            changes[(*coord, previous_day + ONE_DAY)] = 0
+    return changes
+
+
+def removed_rows(previous, current, value):
+    """
+    Get the previous metric rows that aren't in current
+
+    A row that we stored before can be missing from the recomputed metrics (for
+    example, because its count has dropped to zero), so rather than overwriting it we
+    need to remove it.  Rows are matched on
+    everything except the value column, and on the day rather than the time because we
+    read times back from the database with a timezone.
+    """
+
+    def key(row):
+        return tuple(
+            (name, v.date() if name == "time" else v)
+            for name, v in sorted(row.items())
+            if name != value
+        )
+
+    current_keys = {key(row) for row in current}
+    return [row for row in previous if key(row) not in current_keys]
+
+
+def _today():
+    return datetime.datetime.now(tz=datetime.UTC).date()
+
+
 def convert_pr_counts_to_metrics(counts, name):
     metrics = []
     for coord, count in counts.items():
@@ -49,20 +217,28 @@ def convert_pr_counts_to_metrics(counts, name):
     return metrics
 
 
-def get_issues_metrics(issues):
+def get_issues_metrics(issues, since=None, change_points=False):
     counts = calculate_issue_counts(issues)
+    if change_points:
+        counts = _change_points(counts)
+    counts = _counts_since(counts, since)
     return convert_issue_counts_to_metrics(counts)
 
 
+def iter_issues_metrics(issues_by_repo, since=None, change_points=False):
+    """
+    Yield the issue metrics for each repo in turn, like iter_pr_metrics
+    """
+    for _, issues in issues_by_repo:
+        yield from get_issues_metrics(issues, since, change_points)
+
+
 def calculate_issue_counts(issues):
+    today = _today()
     counts = defaultdict(int)
     for issue in issues:
         start = issue.created_on
-        end = (
-            issue.closed_on
-            if issue.closed_on
-            else datetime.datetime.now(tz=datetime.UTC).date()
-        )
+        end = issue.closed_on if issue.closed_on else today
         for day in iter_days(start, end):
             counts[(issue.repo.org, issue.repo.name, issue.author, day)] += 1
     return dict(counts)
@@ -1,9 +1,16 @@
+import datetime
+import functools
 import itertools
 import os
+import threading
 
+from metrics.github.cache import ResponseCache
+from metrics.github.checkpoint import CheckpointStore
 from metrics.github.client import GitHubClient
+from metrics.github.snapshot import recorded, recorded_per_repo
 
 
+@recorded("repos")
 def repos(org):
     query = """
     query repos($cursor: String, $org: String!) {
@@ -28,6 +35,7 @@ def repos(org):
     )
 
 
+@recorded("team_repos")
 def team_repos(org, team):
     """The API doesn't make it easy for us to get all the information we need about repos in
     one place, so we just return a list of repos here and join that to the richer repo objects
@@ -37,6 +45,7 @@ def team_repos(org, team):
         yield repo["name"]
 
 
+@recorded("team_members")
 def team_members(org, team):
     members = _client().rest_query(
         "/orgs/{org}/teams/{team}/members", org=org, team=team
@@ -45,44 +54,16 @@ def team_members(org, team):
         yield member["login"]
 
 
-def vulnerabilities(org, repo):
-    query = """
-    query vulnerabilities($cursor: String, $org: String!, $repo: String!) {
-      organization(login: $org) {
-        repository(name: $repo) {
-          name
-          vulnerabilityAlerts(first: 100, after: $cursor) {
-            nodes {
+# The fields we select on the nodes of each of the per-repo connections that we page
+# through. They're shared by the single-repo and batched queries.
+_VULNERABILITY_FIELDS = """
               createdAt
               fixedAt
               dismissedAt
               autoDismissedAt
-            }
-            pageInfo {
-              endCursor
-              hasNextPage
-            }
-          }
-        }
-      }
-    }
-    """
-
-    return _client().graphql_query(
-        query,
-        path=["organization", "repository", "vulnerabilityAlerts"],
-        org=org,
-        repo=repo,
-    )
+"""
 
-
-def prs(org, repo):
-    query = """
-    query prs($cursor: String, $org: String!, $repo: String!) {
-      organization(login: $org) {
-        repository(name: $repo) {
-          pullRequests(first: 100, after: $cursor) {
-            nodes {
+_PR_FIELDS = """
               author {
                 login
               }
@@ -90,69 +71,285 @@ def prs(org, repo):
               createdAt
               closedAt
               mergedAt
-            }
-            pageInfo {
-              endCursor
-              hasNextPage
-            }
-          }
-        }
-      }
-    }
-    """
-    return maybe_truncate(
-        _client().graphql_query(
-            query,
-            path=["organization", "repository", "pullRequests"],
-            org=org,
-            repo=repo,
-        )
-    )
+"""
 
-
-def issues(org, repo):
-    query = """
-    query issues($cursor: String, $org: String!, $repo: String!) {
-      organization(login: $org) {
-        repository(name: $repo) {
-          issues(first: 100, after: $cursor) {
-            nodes {
+_ISSUE_FIELDS = """
               author {
                 login
               }
               createdAt
               closedAt
-            }
-            pageInfo {
-              endCursor
-              hasNextPage
-            }
-          }
-        }
-      }
-    }
-    """
+"""
+
+# The number of repos whose first pages we fetch in a single query
+BATCH_SIZE = 25
+
+
+def vulnerabilities(org, repo, cursor=None):
+    return _repo_connection(
+        org, repo, "vulnerabilityAlerts", _VULNERABILITY_FIELDS, cursor
+    )
+
+
+def prs(org, repo, cursor=None):
     return maybe_truncate(
-        _client().graphql_query(
+        _repo_connection(org, repo, "pullRequests", _PR_FIELDS, cursor)
+    )
+
+
+def issues(org, repo, cursor=None):
+    return maybe_truncate(_repo_connection(org, repo, "issues", _ISSUE_FIELDS, cursor))
+
+
+def prs_updated_since(org, repo, since):
+    """
+    Get the PRs in a repo that have been updated at or after since, most recent first
+
+    If since is None then we get all the PRs.
+    """
+    nodes = _repo_connection(
+        org,
+        repo,
+        "pullRequests",
+        _PR_FIELDS + "              updatedAt\n",
+        cursor=None,
+        order_by="{field: UPDATED_AT, direction: DESC}",
+    )
+    # Stopping here stops us from fetching any more pages
+    return itertools.takewhile(
+        lambda node: (
+            since is None or datetime.datetime.fromisoformat(node["updatedAt"]) >= since
+        ),
+        nodes,
+    )
+
+
+# GitHub's search API only returns the first 1000 results of each search
+SEARCH_LIMIT = 1000
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+
+def prs_updated_in_org(org, since):
+    """
+    Get the PRs in any of an org's repos that have been updated at or after since
+
+    Rather than querying each repo, we search the whole org for PRs that have been
+    updated, so the number of requests depends on how many PRs have been updated
+    rather than on how many repos there are.  Each node has the repository's name.
+    """
+    return _search_updated(
+        org,
+        "pr",
+        "PullRequest",
+        _PR_FIELDS + "              updatedAt\n",
+        since,
+        datetime.datetime.now(tz=datetime.UTC),
+    )
+
+
+def _search_updated(org, kind, node_type, fields, start, end):
+    """
+    Search for the org's issues or PRs (depending on kind) updated from start to end
+
+    If there are more than SEARCH_LIMIT results then we split the time range in two
+    and search each half separately, recursively.  Search ranges include both ends, and
+    GitHub's timestamps are in whole seconds, so the halves don't overlap.
+    """
+    query = f"""
+    query search($cursor: String, $org: String!, $search: String!) {{
+      organization(login: $org) {{
+        login
+      }}
+      search(type: ISSUE, query: $search, first: 100, after: $cursor) {{
+        issueCount
+        nodes {{
+          ... on {node_type} {{
+              repository {{
+                name
+              }}{fields}            }}
+        }}
+        pageInfo {{
+          endCursor
+          hasNextPage
+        }}
+      }}
+    }}
+    """
+    start = start.astimezone(datetime.UTC).replace(microsecond=0)
+    end = end.astimezone(datetime.UTC).replace(microsecond=0)
+    search = f"org:{org} is:{kind} updated:{_iso(start)}..{_iso(end)}"
+
+    page = _client().graphql_query_page(query, cursor=None, org=org, search=search)
+    page = page["search"]
+
+    if page["issueCount"] > SEARCH_LIMIT and end > start:
+        middle = start + (end - start) / 2
+        yield from _search_updated(org, kind, node_type, fields, start, middle)
+        yield from _search_updated(
+            org, kind, node_type, fields, middle + ONE_SECOND, end
+        )
+        return
+
+    yield from page["nodes"]
+    if page["pageInfo"]["hasNextPage"]:
+        yield from _client().graphql_query(
             query,
-            path=["organization", "repository", "issues"],
+            path=["search"],
+            cursor=page["pageInfo"]["endCursor"],
             org=org,
-            repo=repo,
+            search=search,
         )
+
+
+def _iso(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@recorded_per_repo("vulnerabilities")
+def vulnerabilities_for_repos(org, repos):
+    return _repos_connections(
+        org, repos, "vulnerabilityAlerts", _VULNERABILITY_FIELDS, vulnerabilities
+    )
+
+
+@recorded_per_repo("prs")
+def prs_for_repos(org, repos):
+    return _repos_connections(org, repos, "pullRequests", _PR_FIELDS, prs)
+
+
+@recorded_per_repo("issues")
+def issues_for_repos(org, repos):
+    return _repos_connections(org, repos, "issues", _ISSUE_FIELDS, issues)
+
+
+def _repo_connection(org, repo, connection, fields, cursor, order_by=None):
+    order = f", orderBy: {order_by}" if order_by else ""
+    query = f"""
+    query {connection}($cursor: String, $org: String!, $repo: String!) {{
+      organization(login: $org) {{
+        repository(name: $repo) {{
+          {connection}(first: 100, after: $cursor{order}) {{
+            nodes {{{fields}            }}
+            pageInfo {{
+              endCursor
+              hasNextPage
+            }}
+          }}
+        }}
+      }}
+    }}
+    """
+    return _client().graphql_query(
+        query,
+        path=["organization", "repository", connection],
+        cursor=cursor,
+        org=org,
+        repo=repo,
+    )
+
+
+def _repos_connections(org, repos, connection, fields, fetch_rest):
+    """
+    Get all the nodes of a connection for each of the given repos, in one list per repo
+
+    Most of our repos have few enough PRs (etc) to fit on one page, so we fetch the
+    first page for all of the repos in a single query, giving each repo its own alias.
+    Only repos with more pages need further requests, for which we use fetch_rest.
+    """
+    aliases = {f"repo{i}": repo for i, repo in enumerate(repos)}
+    if not aliases:
+        return []
+
+    declarations = "".join(f", ${alias}: String!" for alias in aliases)
+    selections = "".join(
+        f"""
+        {alias}: repository(name: ${alias}) {{
+          {connection}(first: 100, after: $cursor) {{
+            nodes {{{fields}            }}
+            pageInfo {{
+              endCursor
+              hasNextPage
+            }}
+          }}
+        }}"""
+        for alias in aliases
+    )
+    query = f"""
+    query {connection}($cursor: String, $org: String!{declarations}) {{
+      organization(login: $org) {{{selections}
+      }}
+    }}
+    """
+    pages = _client().graphql_query_pages(
+        query,
+        paths={alias: ["organization", alias, connection] for alias in aliases},
+        org=org,
+        **aliases,
     )
 
+    results = []
+    for alias, repo in aliases.items():
+        page = pages[alias]
+        nodes = page["nodes"]
+        if page["pageInfo"]["hasNextPage"]:
+            cursor = page["pageInfo"]["endCursor"]
+            nodes = itertools.chain(nodes, fetch_rest(org, repo, cursor=cursor))
+        results.append(list(maybe_truncate(nodes)))
+    return results
 
+
+@recorded("dependabot_alerts")
+def dependabot_alerts(org):
+    """
+    Get the Dependabot alerts in all of an org's repos, in every state
+
+    This takes a page per 100 alerts, rather than a query per repo like
+    vulnerabilities_for_repos.  Each alert has the repository's name.
+    """
+    yield from _client().rest_query(
+        "/orgs/{org}/dependabot/alerts?state={state}&per_page=100",
+        org=org,
+        state="auto_dismissed,dismissed,fixed,open",
+    )
+
+
+@recorded("codespaces")
 def codespaces(org):
     yield from _client().rest_query("/orgs/{org}/codespaces", org=org)
 
 
+# Tasks run on several threads, and they must all share a single client so that they
+# share its limits on concurrent requests (see GitHubClient)
+_client_lock = threading.Lock()
+
+
 def _client():
+    with _client_lock:
+        return _make_client()
+
+
+@functools.cache
+def _make_client():
+    # See DEVELOPERS.md
+    cache = (
+        ResponseCache(os.environ["GITHUB_CACHE_PATH"])
+        if "GITHUB_CACHE_PATH" in os.environ
+        else None
+    )
+    checkpoints = (
+        CheckpointStore(os.environ["GITHUB_CHECKPOINT_PATH"])
+        if "GITHUB_CHECKPOINT_PATH" in os.environ
+        else None
+    )
     return GitHubClient(
         tokens={
             "ebmdatalab": os.environ["GITHUB_EBMDATALAB_TOKEN"],
             "opensafely-core": os.environ["GITHUB_OS_CORE_TOKEN"],
             "opensafely": os.environ["GITHUB_OS_TOKEN"],
-        }
+        },
+        cache=cache,
+        checkpoints=checkpoints,
+        resume="GITHUB_RESUME" in os.environ,
     )
 
 
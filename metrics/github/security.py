@@ -1,11 +1,13 @@
 import datetime
+import itertools
+from collections import Counter, defaultdict
 from dataclasses import dataclass
 
 from ..tools import dates
 from . import github, query
 
 
-@dataclass
+@dataclass(slots=True)
 class Vulnerability:
     created_on: datetime.date
     fixed_on: datetime.date | None
@@ -25,6 +27,11 @@ class Vulnerability:
             )
         )
 
+    @property
+    def closed_on(self):
+        dates = [self.fixed_on, self.dismissed_on, self.auto_dismissed_on]
+        return min((d for d in dates if d is not None), default=None)
+
     @staticmethod
     def from_dict(my_dict):
         return Vulnerability(
@@ -34,29 +41,108 @@ class Vulnerability:
             dates.date_from_iso(my_dict["autoDismissedAt"]),
         )
 
+    @staticmethod
+    def from_rest_dict(my_dict):
+        return Vulnerability(
+            dates.date_from_iso(my_dict["created_at"]),
+            dates.date_from_iso(my_dict["fixed_at"]),
+            dates.date_from_iso(my_dict["dismissed_at"]),
+            dates.date_from_iso(my_dict["auto_dismissed_at"]),
+        )
+
+
+def vulnerabilities(to_date, change_points=False, org_alerts=False):
+    """
+    Get the counts of open and closed vulnerabilities in each tech repo for each day
+
+    If change_points is True then we only get the counts for each repo's first day and
+    the days on which they change.  If org_alerts is True then we get each org's
+    Dependabot alerts all at once, rather than querying each repo.
+    """
+    return list(iter_vulnerabilities(to_date, change_points, org_alerts))
+
 
-def vulnerabilities(to_date):
-    metrics = []
+def iter_vulnerabilities(to_date, change_points=False, org_alerts=False):
+    """
+    Yield the counts for each repo in turn, like vulnerabilities
 
-    for repo in github.tech_repos():
-        vulns = list(
-            map(Vulnerability.from_dict, query.vulnerabilities(repo.org, repo.name))
+    We fetch each repo's vulnerabilities as they're needed, so we only hold a few
+    repos' vulnerabilities in memory at once.
+    """
+    repos = github.tech_repos()
+    if org_alerts:
+        vulns_by_repo = _vulnerabilities_from_org_alerts(repos)
+    else:
+        vulns_by_repo = (
+            (repo, list(map(Vulnerability.from_dict, nodes)))
+            for repo, nodes in github.for_each_repo(
+                query.vulnerabilities_for_repos, repos
+            )
         )
 
-        for day in dates.iter_days(repo.created_on, to_date):
-            closed_vulns = sum(1 for v in vulns if v.is_closed_on(day))
-            open_vulns = sum(1 for v in vulns if v.is_open_on(day))
-
-            metrics.append(
-                {
-                    "time": day,
-                    "closed": closed_vulns,
-                    "open": open_vulns,
-                    "organisation": repo.org,
-                    "repo": repo.name,
-                    "has_alerts_enabled": repo.has_vulnerability_alerts_enabled,
-                    "value": 0,  # needed for the timescaledb
-                }
+    for repo, vulns in vulns_by_repo:
+        previous = None
+        for day, open_vulns, closed_vulns in daily_counts(
+            vulns, repo.created_on, to_date
+        ):
+            if change_points and (open_vulns, closed_vulns) == previous:
+                continue
+            previous = open_vulns, closed_vulns
+            yield {
+                "time": day,
+                "closed": closed_vulns,
+                "open": open_vulns,
+                "organisation": repo.org,
+                "repo": repo.name,
+                "has_alerts_enabled": repo.has_vulnerability_alerts_enabled,
+                "value": 0,  # needed for the timescaledb
+            }
+
+
+def _vulnerabilities_from_org_alerts(repos):
+    """
+    Yield (repo, vulns) for each repo, from its org's Dependabot alerts
+
+    We fetch all of an org's alerts once and group them by repo.  Alerts for repos
+    that aren't in repos are ignored.
+    """
+    for org, org_repos in itertools.groupby(repos, lambda repo: repo.org):
+        vulns_by_name = defaultdict(list)
+        for alert in query.dependabot_alerts(org):
+            vulns_by_name[alert["repository"]["name"]].append(
+                Vulnerability.from_rest_dict(alert)
             )
+        for repo in org_repos:
+            yield repo, vulns_by_name[repo.name]
+
+
+def daily_counts(vulns, start, end):
+    """
+    Yield (day, open, closed) for each day from start to end, inclusive
+
+    The counts are the numbers of vulns that were open and closed on each day, as given
+    by Vulnerability.is_open_on and Vulnerability.is_closed_on.  Rather than asking
+    every vuln about every day, we note the days on which each count changes, and then
+    walk through the days once, applying the changes as we reach them.
+    """
+    open_changes = Counter()
+    closed_changes = Counter()
+    for v in vulns:
+        closed_on = v.closed_on
+        if closed_on is not None:
+            closed_changes[closed_on] += 1
+        # A vuln is open from the day it's created until the day before it's closed
+        if closed_on is None or closed_on > v.created_on:
+            open_changes[v.created_on] += 1
+            if closed_on is not None:
+                open_changes[closed_on] -= 1
 
-    return metrics
+    changes = sorted(open_changes.keys() | closed_changes.keys())
+    next_change = 0
+    open_count = closed_count = 0
+    for day in dates.iter_days(start, end):
+        while next_change < len(changes) and changes[next_change] <= day:
+            open_count += open_changes[changes[next_change]]
+            closed_count += closed_changes[changes[next_change]]
+            next_change += 1
+        yield day, open_count, closed_count
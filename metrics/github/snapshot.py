@@ -0,0 +1,111 @@
+"""
+Snapshots of the raw data that we fetch from GitHub, for recomputing metrics offline
+
+If GITHUB_SNAPSHOT_DIR is set then the results of the queries decorated here are
+written to a snapshot in a directory inside it, named after the day that the run
+started.  If GITHUB_FROM_SNAPSHOT is set to one of those dated directories then the
+queries read their results from it instead of from GitHub.  See DEVELOPERS.md.
+
+Each result is a list of nodes, which we store as gzipped JSON lines, in a file for
+each query and each set of arguments (for example, each org and repo).
+"""
+
+import datetime
+import functools
+import gzip
+import json
+import os
+import pathlib
+import threading
+
+
+def recorded(kind):
+    """
+    Record or replay the results of a query that takes an org and other arguments
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(org, *args):
+            key = (kind, org, *args)
+            if "GITHUB_FROM_SNAPSHOT" in os.environ:
+                return _read(key)
+
+            nodes = list(func(org, *args))
+            if "GITHUB_SNAPSHOT_DIR" in os.environ:
+                _write(key, nodes)
+            return nodes
+
+        return wrapper
+
+    return decorator
+
+
+def recorded_per_repo(kind):
+    """
+    Record or replay the results of a query that takes an org and a list of repos, and
+    returns a list of nodes for each repo
+
+    Each repo's nodes are stored separately, so a repo's nodes can be replayed whichever
+    batch of repos it was fetched in.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(org, repos):
+            if "GITHUB_FROM_SNAPSHOT" in os.environ:
+                return [_read((kind, org, repo)) for repo in repos]
+
+            nodes_by_repo = [list(nodes) for nodes in func(org, repos)]
+            if "GITHUB_SNAPSHOT_DIR" in os.environ:
+                for repo, nodes in zip(repos, nodes_by_repo):
+                    _write((kind, org, repo), nodes)
+            return nodes_by_repo
+
+        return wrapper
+
+    return decorator
+
+
+def _write(key, nodes):
+    path = _path(_snapshot_dir(), key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first so that we never leave a partial snapshot file
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for node in nodes:
+            f.write(json.dumps(node) + "\n")
+    tmp_path.replace(path)
+
+
+# A run writes all of its snapshot to the directory for the day that it started on, even
+# if it carries on past midnight, so that the snapshot can be replayed as a whole.  Call
+# clear_cache() to start a new snapshot.
+_snapshot_dir_lock = threading.Lock()
+
+
+def _snapshot_dir():
+    with _snapshot_dir_lock:
+        return _dated_dir(os.environ["GITHUB_SNAPSHOT_DIR"])
+
+
+@functools.cache
+def _dated_dir(root):
+    today = datetime.datetime.now(tz=datetime.UTC).date().isoformat()
+    return pathlib.Path(root) / today
+
+
+def clear_cache():
+    _dated_dir.cache_clear()
+
+
+def _read(key):
+    path = _path(pathlib.Path(os.environ["GITHUB_FROM_SNAPSHOT"]), key)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _path(directory, key):
+    *dirs, name = key
+    return directory.joinpath(*dirs, f"{name}.jsonl.gz")
@@ -0,0 +1,195 @@
+import datetime
+import itertools
+import os
+from dataclasses import dataclass
+
+from metrics.github import query
+from metrics.github.metrics import removed_rows
+from metrics.github.snapshot import recorded_per_repo
+from metrics.timescaledb import db, tables
+
+
+@recorded_per_repo("prs")
+def prs_for_repos(org, repos):
+    """
+    Get the PRs for each of the repos, in one list per repo, like query.prs_for_repos
+
+    Rather than fetching every PR, we keep the PRs that we've already fetched in the
+    database.  For each repo we only fetch the PRs that have been updated since the
+    most recently updated PR that we've stored (the repo's watermark) and merge them
+    into the store.  Repos that we've never synced before are fetched in full.
+
+    If prepare() has searched the org for updated PRs (see INCREMENTAL_SYNC_SEARCH)
+    then we take the updated PRs for the repos that it covered from the search, rather
+    than querying each repo.
+    """
+    stored = {repo: {} for repo in repos}
+    for row in db.read(tables.GitHubPullRequestStore, organisation=org, repo=repos):
+        stored[row["repo"]][row["number"]] = row
+
+    search = _searches.get(org)
+
+    # A PR can come back more than once if it's updated while we're paging through the
+    # PRs, which pushes the others down a page, so we key the updated rows by PR
+    updated_rows = {}
+    synced_at = {}
+    for repo in repos:
+        if search and repo in search.repos:
+            nodes = search.prs_by_repo.get(repo, [])
+            synced_at[repo] = search.until
+        else:
+            # We re-fetch PRs updated at the watermark itself, in case there were
+            # several updated at the same time and we didn't get all of them last time.
+            watermark = max(
+                (row["updated_at"] for row in stored[repo].values()), default=None
+            )
+            synced_at[repo] = _now()
+            nodes = query.prs_updated_since(org, repo, watermark)
+
+        for node in nodes:
+            row = _node_to_row(org, repo, node)
+            stored[repo][row["number"]] = row
+            updated_rows[(org, repo, row["number"])] = row
+
+    db.upsert(tables.GitHubPullRequestStore, updated_rows.values())
+    db.upsert(
+        tables.GitHubPullRequestSyncs,
+        [
+            {"organisation": org, "repo": repo, "synced_at": time}
+            for repo, time in synced_at.items()
+        ],
+    )
+
+    return [[_row_to_node(row) for row in stored[repo].values()] for repo in repos]
+
+
+# GitHub's search index can lag behind updates, so we search from a little before the
+# time that we last synced up to
+SEARCH_LAG = datetime.timedelta(hours=1)
+
+
+@dataclass(frozen=True)
+class _Search:
+    until: datetime.datetime
+    repos: frozenset
+    prs_by_repo: dict
+
+
+# The results of prepare()'s searches, by org
+_searches = {}
+
+
+def prepare(repos):
+    """
+    Search each org once for the PRs in the repos that have been updated since we last
+    synced them, if INCREMENTAL_SYNC_SEARCH is set
+
+    Each repo that we've synced before has a time that we synced it up to, and we
+    search from the earliest of these for the repos in each org.  A repo's time can be
+    well behind the others', for example if a run failed part way through or the repo
+    was out of the tech teams for a while, so we can't search from the latest.  We
+    read the times before we fetch anything, because prs_for_repos updates them.
+    Repos that we haven't synced before are left to prs_for_repos to fetch in full.
+    """
+    _searches.clear()
+    if "INCREMENTAL_SYNC_SEARCH" not in os.environ:
+        return
+
+    synced_at = db.latest_times(
+        tables.GitHubPullRequestSyncs,
+        "organisation",
+        "repo",
+        time_column="synced_at",
+    )
+    for org, org_repos in itertools.groupby(repos, lambda repo: repo.org):
+        synced = {
+            repo.name: synced_at[(org, repo.name)]
+            for repo in org_repos
+            if (org, repo.name) in synced_at
+        }
+        if not synced:
+            continue
+
+        # PRs updated after we start searching might not be in the results, so the
+        # repos are only synced up to now
+        until = _now()
+        prs_by_repo = {}
+        since = min(synced.values()) - SEARCH_LAG
+        for node in query.prs_updated_in_org(org, since):
+            repo = node["repository"]["name"]
+            prs_by_repo.setdefault(repo, {})[node["number"]] = node
+        _searches[org] = _Search(
+            until,
+            frozenset(synced),
+            {repo: list(prs.values()) for repo, prs in prs_by_repo.items()},
+        )
+
+
+def clear_cache():
+    _searches.clear()
+
+
+def _now():
+    return datetime.datetime.now(tz=datetime.UTC)
+
+
+def update_metrics(table, get_metrics, value):
+    """
+    Update a table of daily metrics, rewriting only the days that can have changed
+
+    get_metrics is called with a dict mapping (org, repo) to the day to get metrics
+    from, like metrics.get_pr_metrics, and can return any iterable.  value is the name of the table's value
+    column.
+
+    A repo's metrics can only change when its PRs or issues are opened, closed or
+    merged, and everything that's happened since we last stored its metrics happened
+    on or after the latest day that we stored.  So we recompute each repo's metrics
+    from that day on, upsert them, and remove the rows for counts that have dropped to
+    zero.  Repos that we've never stored metrics for get all of their metrics.
+    """
+    latest = db.latest_times(table, "organisation", "repo")
+    metrics = list(get_metrics({repo: time.date() for repo, time in latest.items()}))
+
+    # Each repo's latest day is the only one of the days that we're recomputing that
+    # we've stored metrics for
+    previous = [
+        dict(row)
+        for row in db.read(table, time=sorted(set(latest.values())))
+        if row["time"] == latest[(row["organisation"], row["repo"])]
+    ]
+
+    db.upsert(table, metrics)
+    db.delete_rows(table, removed_rows(previous, metrics, value))
+
+
+def _node_to_row(org, repo, node):
+    return {
+        "organisation": org,
+        "repo": repo,
+        "number": node["number"],
+        "author": node["author"]["login"],
+        "created_at": _from_iso(node["createdAt"]),
+        "closed_at": _from_iso(node["closedAt"]),
+        "merged_at": _from_iso(node["mergedAt"]),
+        "updated_at": _from_iso(node["updatedAt"]),
+    }
+
+
+def _row_to_node(row):
+    return {
+        "author": {"login": row["author"]},
+        "number": row["number"],
+        "createdAt": _to_iso(row["created_at"]),
+        "closedAt": _to_iso(row["closed_at"]),
+        "mergedAt": _to_iso(row["merged_at"]),
+    }
+
+
+def _from_iso(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _to_iso(value):
+    # The database gives us times in its session's timezone, but GitHub gives us them
+    # in UTC, and we take the date from them
+    return value.astimezone(datetime.UTC).isoformat() if value else None
@@ -1,17 +1,35 @@
+import argparse
+import os
 import pkgutil
 
 import structlog
 
 import metrics.tasks
+from metrics.github import client
+from metrics.github.checkpoint import CheckpointStore
 from metrics.sentry.cron import Cron
+from metrics.timescaledb import db
+from metrics.tools import dag
 
 
 log = structlog.get_logger()
 sentry_cron = Cron()
 
-for _, modname, _ in pkgutil.iter_modules(metrics.tasks.__path__):
-    if modname != "__main__":
-        log.info(f"Found {modname}")
+# Tasks that don't depend on each other run at the same time, up to this many at once
+MAX_WORKERS = int(os.environ.get("TASK_WORKERS", "4"))
+
+# Every task that runs at once can replace a table over db.WRITE_WORKERS connections
+# while reading over another, and the incremental PR sync writes each of the batches of
+# repos that it fetches at once (up to client.MAX_WORKERS of them) over its own
+# connection, so we size the database's connection pool for all of them
+os.environ.setdefault(
+    "DB_POOL_SIZE",
+    str(MAX_WORKERS * (db.WRITE_WORKERS + 1) + client.MAX_WORKERS),
+)
+
+
+def run_task(modname):
+    def run():
         monitor = sentry_cron.get_monitor(modname)
         monitor.in_progress()
         try:
@@ -20,7 +38,75 @@ for _, modname, _ in pkgutil.iter_modules(metrics.tasks.__path__):
         except AttributeError as error:
             log.error(f"Skipping {modname} because {error}")
             monitor.error(error)
+            raise
         except Exception as exc:
             log.error(f"Failed to run {modname} because because an error occurred.")
             log.exception()
             monitor.error(exc)
+            raise
+
+    return run
+
+
+def depends_on(modname):
+    """
+    The names of the tasks that a task depends on, from its module's depends_on list
+    """
+    try:
+        module = pkgutil.resolve_name(f"metrics.tasks.{modname}")
+    except ImportError:
+        # we'll report why the module can't be imported when we run it
+        return []
+    return getattr(module, "depends_on", [])
+
+
+parser = argparse.ArgumentParser(prog="python -m metrics.tasks")
+parser.add_argument(
+    "--from-snapshot",
+    metavar="DIR",
+    help="read GitHub data from a snapshot rather than from GitHub (see DEVELOPERS.md)",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="carry on from the GitHub queries of a run that failed (see DEVELOPERS.md)",
+)
+args = parser.parse_args()
+if args.from_snapshot:
+    os.environ["GITHUB_FROM_SNAPSHOT"] = args.from_snapshot
+
+checkpoints = (
+    CheckpointStore(os.environ["GITHUB_CHECKPOINT_PATH"])
+    if "GITHUB_CHECKPOINT_PATH" in os.environ
+    else None
+)
+if args.resume and not checkpoints:
+    parser.error("--resume needs GITHUB_CHECKPOINT_PATH to be set")
+if args.resume:
+    os.environ["GITHUB_RESUME"] = "t"
+elif checkpoints:
+    checkpoints.clear()
+
+modnames = [
+    modname
+    for _, modname, _ in pkgutil.iter_modules(metrics.tasks.__path__)
+    if modname != "__main__"
+]
+for modname in modnames:
+    log.info(f"Found {modname}")
+
+outcomes = dag.run(
+    {modname: run_task(modname) for modname in modnames},
+    {modname: depends_on(modname) for modname in modnames},
+    max_workers=MAX_WORKERS,
+)
+
+for modname, outcome in outcomes.items():
+    if outcome == dag.SKIPPED:
+        error = RuntimeError(f"{modname} depends on a task that didn't succeed")
+        log.error(f"Skipping {modname} because {error}")
+        sentry_cron.get_monitor(modname).error(error)
+
+# Once every task has succeeded there's nothing left to resume
+if checkpoints and all(outcome == dag.OK for outcome in outcomes.values()):
+    checkpoints.clear()
@@ -1,9 +1,11 @@
+import os
 import sys
 
 import structlog
 
-from metrics.github.github import tech_issues
-from metrics.github.metrics import get_issues_metrics
+from metrics.github import sync
+from metrics.github.github import iter_tech_issues
+from metrics.github.metrics import iter_issues_metrics
 from metrics.timescaledb import db, tables
 
 
@@ -11,17 +13,27 @@ log = structlog.get_logger()
 
 
 def main():
-    log.info("Getting metrics")
-    issues = tech_issues()
-    log.info(f"Got {len(issues)} issues")
-
-    metrics = get_issues_metrics(issues)
-    log.info("Got metrics")
-
-    log.info("Writing data")
-    db.reset_table(tables.GitHubIssues)
-    db.write(tables.GitHubIssues, metrics)
-    log.info("Written data")
+    # The issues are fetched and their metrics computed one batch of repos at a time,
+    # as the metrics are written
+    issues_by_repo = iter_tech_issues()
+    change_points = "GAUGE_CHANGE_POINTS" in os.environ
+
+    if "INCREMENTAL_METRICS" in os.environ:
+        log.info("Updating metrics")
+        sync.update_metrics(
+            tables.GitHubIssues,
+            lambda since: iter_issues_metrics(issues_by_repo, since, change_points),
+            "count",
+        )
+        log.info("Updated metrics")
+        return
+
+    log.info("Writing metrics")
+    db.replace_table(
+        tables.GitHubIssues,
+        iter_issues_metrics(issues_by_repo, change_points=change_points),
+    )
+    log.info("Written metrics")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
+import os
 import sys
 
 import structlog
 
-from metrics.github.github import tech_prs
-from metrics.github.metrics import get_pr_metrics
+from metrics.github import sync
+from metrics.github.github import iter_tech_prs
+from metrics.github.metrics import iter_pr_metrics
 from metrics.timescaledb import db, tables
 
 
@@ -11,17 +13,27 @@ log = structlog.get_logger()
 
 
 def main():
-    log.info("Getting metrics")
-    prs = tech_prs()
-    log.info(f"Got {len(prs)} PRs")
-
-    metrics = get_pr_metrics(prs)
-    log.info("Got metrics")
-
-    log.info("Writing data")
-    db.reset_table(tables.GitHubPullRequests)
-    db.write(tables.GitHubPullRequests, metrics)
-    log.info("Written data")
+    # The PRs are fetched and their metrics computed one batch of repos at a time, as
+    # the metrics are written
+    prs_by_repo = iter_tech_prs(incremental="INCREMENTAL_SYNC" in os.environ)
+    change_points = "GAUGE_CHANGE_POINTS" in os.environ
+
+    if "INCREMENTAL_METRICS" in os.environ:
+        log.info("Updating metrics")
+        sync.update_metrics(
+            tables.GitHubPullRequests,
+            lambda since: iter_pr_metrics(prs_by_repo, since, change_points),
+            "value",
+        )
+        log.info("Updated metrics")
+        return
+
+    log.info("Writing metrics")
+    db.replace_table(
+        tables.GitHubPullRequests,
+        iter_pr_metrics(prs_by_repo, change_points=change_points),
+    )
+    log.info("Written metrics")
 
 
 if __name__ == "__main__":
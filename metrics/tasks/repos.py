@@ -17,8 +17,7 @@ def main():
     data = [{"organisation": r.org, "repo": r.name, "owner": r.team} for r in repos]
 
     log.info("Writing data")
-    db.reset_table(tables.GitHubRepos)
-    db.write(tables.GitHubRepos, data)
+    db.replace_table(tables.GitHubRepos, data)
     log.info("Written data")
 
 
@@ -33,8 +33,7 @@ def main():
             }
         )
 
-    db.reset_table(tables.SlackTechSupport)
-    db.write(tables.SlackTechSupport, rows)
+    db.replace_table(tables.SlackTechSupport, rows)
 
 
 if __name__ == "__main__":
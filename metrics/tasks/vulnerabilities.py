@@ -1,9 +1,10 @@
 import datetime
+import os
 import sys
 
 import structlog
 
-from metrics.github.security import vulnerabilities
+from metrics.github.security import iter_vulnerabilities
 from metrics.timescaledb import db, tables
 
 
@@ -11,13 +12,18 @@ log = structlog.get_logger()
 
 
 def main():
-    yesterday = datetime.date.now(tz=datetime.UTC).date() - datetime.timedelta(days=1)
+    yesterday = datetime.datetime.now(tz=datetime.UTC).date() - datetime.timedelta(
+        days=1
+    )
 
     log.info("Fetching vulnerabilities")
-    vulns = vulnerabilities(yesterday)
+    vulns = iter_vulnerabilities(
+        yesterday,
+        change_points="GAUGE_CHANGE_POINTS" in os.environ,
+        org_alerts="DEPENDABOT_ORG_ALERTS" in os.environ,
+    )
 
-    db.reset_table(tables.GitHubVulnerabilities)
-    db.write(tables.GitHubVulnerabilities, vulns)
+    db.replace_table(tables.GitHubVulnerabilities, vulns)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,32 @@
 import atexit
+import datetime
 import functools
 import os
+import queue
+import weakref
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 import structlog
-from sqlalchemy import create_engine, inspect, schema, text
-from sqlalchemy.dialects.postgresql import insert
+from psycopg import sql
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Table,
+    create_engine,
+    delete,
+    event,
+    exists,
+    func,
+    insert,
+    inspect,
+    or_,
+    schema,
+    select,
+    text,
+    update,
+)
 from sqlalchemy.engine import make_url
 
 from ..tools.iter import batched
@@ -12,62 +34,489 @@ from ..tools.iter import batched
 
 log = structlog.get_logger()
 
+# Weekly aggregates bucket days into weeks that start on Saturdays, like the dashboards
+# do.  Any Saturday will do as the origin.
+WEEK_ORIGIN = "2000-01-01"
+
+# replace_table loads big hypertables over this many connections at once
+WRITE_WORKERS = int(os.environ.get("DB_WRITE_WORKERS", "1"))
+
+# TimescaleDB's default chunk interval, for tables that don't declare their own
+CHUNK_TIME_INTERVAL = datetime.timedelta(days=7)
+
+# Rows are handed to the connections loading them in batches of this many, and each
+# connection has at most a few batches waiting for it
+WRITE_BATCH_SIZE = 1000
+WRITE_QUEUE_SIZE = 4
+
+# The names of the tables that we've made sure exist, for each engine, so that we
+# don't have to check every time we write to them
+_ready_tables = weakref.WeakKeyDictionary()
+
+
+@dataclass(frozen=True)
+class UpsertCounts:
+    inserted: int
+    updated: int
+    unchanged: int
+
 
 def reset_table(table, batch_size=None):
+    _forget_table(table)
     with _get_engine().begin() as connection:
+        _drop_weekly_aggregate(connection, table)
         _drop_table(connection, table, batch_size)
         _ensure_table(connection, table)
         log.info("Reset table", table=table.name)
 
 
+def replace_table(table, rows):
+    """
+    Replace all of the rows in a table
+
+    Rather than emptying the table and then writing to it, which leaves readers looking
+    at an empty table while we write, we write the rows to a shadow table and then swap
+    the two tables' names in a single transaction.  Readers see either all of the old
+    rows or all of the new rows.  The old table is then dropped chunk by chunk.
+
+    A table's weekly aggregate is defined on the table itself rather than on its name,
+    so we drop it and create it again on the new table as part of the swap.
+
+    If WRITE_WORKERS is more than one then we load a hypertable's shadow table over
+    that many connections at once (see _copy_in_parallel).  The shadow table is only
+    swapped in if they all succeed.  Its old chunks are compressed before the swap, if
+    its settings ask for it (see _compress_old_chunks).
+    """
+    shadow = _renamed(table, f"{table.name}_shadow")
+    old = _renamed(table, f"{table.name}_old")
+
+    # either of these could have been left behind by a run that failed part way through
+    _drop_table_in_chunks(shadow)
+    _drop_table_in_chunks(old)
+
+    if WRITE_WORKERS > 1 and _is_hypertable(table):
+        with _get_engine().begin() as connection:
+            _ensure_table(connection, shadow)
+        count = _copy_in_parallel(shadow, rows, WRITE_WORKERS)
+    else:
+        with _get_engine().begin() as connection:
+            _ensure_table(connection, shadow)
+            count = _copy(connection, shadow, rows)
+    log.debug("Loaded %s rows into shadow table", count, table=table.name)
+    _compress_old_chunks(shadow)
+
+    _forget_table(table)
+    with _get_engine().begin() as connection:
+        _drop_weekly_aggregate(connection, table)
+        if _has_table(connection, table):
+            _rename_table(connection, table.name, old.name)
+        _rename_table(connection, shadow.name, table.name)
+        _create_weekly_aggregate(connection, table)
+        log.debug("Swapped in shadow table", table=table.name)
+
+    _drop_table_in_chunks(old)
+    _refresh_weekly_aggregate(table)
+    log.info("Replaced table with %s rows", count, table=table.name)
+
+
 def write(table, rows):
-    batch_size = _batch_size(table)
+    """
+    Write rows to a table
 
+    Each row is either a dict or a sequence of values in the order of the table's
+    columns.  Rows are streamed to the database with COPY, so rows can be any iterable
+    and we never hold more than one of them at a time.
+    """
     with _get_engine().begin() as connection:
-        for values in batched(rows, batch_size):
-            connection.execute(insert(table).values(values))
-            log.info("Inserted %s rows", len(values), table=table.name)
+        count = _copy(connection, table, rows)
+        log.info("Inserted %s rows", count, table=table.name)
+    _refresh_weekly_aggregate(table)
 
 
 def upsert(table, rows):
+    """
+    Write rows to a table, replacing any rows with the same primary key
+
+    We COPY the rows into a temporary staging table, and then compare them with the
+    target table on the primary key.  We only update the rows whose other columns have
+    changed, and only insert the rows that are new, so that rows that haven't changed
+    aren't rewritten.
+
+    Returns the numbers of rows that were inserted, updated and unchanged.
+    """
+    engine = _get_engine()
+    with engine.begin() as connection:
+        _ensure_table_once(connection, table)
+        staging = _create_staging_table(connection, table)
+        count = _copy(connection, staging, rows)
+
+        pk_columns = list(table.primary_key.columns)
+        non_pk_columns = [c for c in table.columns if c not in pk_columns]
+        matches_pk = [c == staging.c[c.name] for c in pk_columns]
+
+        updated = 0
+        if non_pk_columns:
+            changed = or_(
+                *[c.is_distinct_from(staging.c[c.name]) for c in non_pk_columns]
+            )
+            updated = connection.execute(
+                update(table)
+                .values({c.name: staging.c[c.name] for c in non_pk_columns})
+                .where(*matches_pk, changed)
+            ).rowcount
+
+        # We count the inserted rows in the database, because the driver doesn't give
+        # us a row count for an INSERT ... SELECT
+        new_rows = select(staging).where(~exists().where(*matches_pk))
+        inserting = (
+            insert(table)
+            .from_select([c.name for c in table.columns], new_rows)
+            .returning(pk_columns[0])
+            .cte()
+        )
+        inserted = connection.scalar(select(func.count()).select_from(inserting))
+
+        counts = UpsertCounts(inserted, updated, count - inserted - updated)
+        log.info(
+            "Upserted %s rows",
+            count,
+            table=table.name,
+            inserted=counts.inserted,
+            updated=counts.updated,
+            unchanged=counts.unchanged,
+        )
+
+    _refresh_weekly_aggregate(table)
+    return counts
+
+
+def replace_range(table, start, end, rows, **filters):
+    """
+    Replace the rows of a hypertable whose times are in [start, end)
+
+    The filters narrow down the rows that are replaced, like read's filters do (for
+    example, to a single repo).  The new rows should be in the range and match the
+    filters.  We delete the old rows and COPY the new rows in a single transaction, so
+    readers see either all of the old rows or all of the new rows.
+
+    If we're replacing all of the rows in the range then we drop the chunks that are
+    entirely inside it, which is much cheaper than deleting their rows, and delete
+    the rest.  We don't do this for tables with a weekly aggregate, because TimescaleDB
+    doesn't update continuous aggregates when chunks are dropped.
+    """
+    assert _is_hypertable(table)
+
     with _get_engine().begin() as connection:
-        _ensure_table(connection, table)
-        batch_size = _batch_size(table)
-        non_pk_columns = set(table.columns) - set(table.primary_key.columns)
-
-        # use the primary key constraint to match rows to be updated,
-        # using default constraint name if not otherwise specified
-        constraint = table.primary_key.name or table.name + "_pkey"
-
-        for values in batched(rows, batch_size):
-            # Construct a PostgreSQL "INSERT..ON CONFLICT" style upsert statement
-            # https://docs.sqlalchemy.org/en/20/dialects/postgresql.html#insert-on-conflict-upsert
-
-            # "Vanilla" statement to start, we need this to be able to derive
-            # the "excluded" columns in the values which we need to use to update
-            # the target table in case of conflict on the constraint
-            insert_stmt = insert(table).values(values)
-
-            # This dict dicates which columns in the target table are updated (the
-            # non-PK columns) and the corresponding values with which they are updated
-            update_set_clause = {
-                c: insert_stmt.excluded[c.name] for c in non_pk_columns
-            }
-
-            # Extend the insert statement to include checking for row conflicts using
-            # the primary key constraint and telling the database to update
-            # the conflicting rows according to the SET clause
-            insert_stmt = insert_stmt.on_conflict_do_update(
-                constraint=constraint,
-                set_=update_set_clause,
+        _ensure_table_once(connection, table)
+        if not filters and not table.info.get("weekly_aggregate"):
+            connection.execute(
+                text(
+                    f"SELECT drop_chunks('{table.name}', "
+                    "older_than => :end, newer_than => :start)"
+                ),
+                {"start": start, "end": end},
+            )
+
+        deleted = connection.execute(
+            delete(table).where(
+                table.c.time >= start,
+                table.c.time < end,
+                *_conditions(table, filters),
+            )
+        ).rowcount
+        count = _copy(connection, table, rows)
+        log.info(
+            "Replaced range with %s rows",
+            count,
+            table=table.name,
+            start=start,
+            end=end,
+            deleted=deleted,
+        )
+
+    _refresh_weekly_aggregate(table)
+
+
+def delete_rows(table, rows):
+    """
+    Delete the rows with the same primary keys as the given rows
+
+    We COPY the rows' primary keys into a temporary staging table, and then delete the
+    matching rows with a single DELETE ... USING statement.
+    """
+    pk_columns = list(table.primary_key.columns)
+    with _get_engine().begin() as connection:
+        if not _has_table(connection, table):
+            return
+        staging = _create_staging_table(connection, table, pk_columns)
+        count = _copy(connection, staging, rows)
+
+        connection.execute(
+            delete(table).where(*[c == staging.c[c.name] for c in pk_columns])
+        )
+        log.info("Deleted up to %s rows", count, table=table.name)
+    _refresh_weekly_aggregate(table)
+
+
+def latest_times(table, *columns, time_column="time"):
+    """
+    Get the latest time in a table for each combination of the given columns' values
+
+    Returns a dict mapping tuples of the columns' values to times.
+    """
+    group = [table.c[name] for name in columns]
+    with _get_engine().connect() as connection:
+        if not _has_table(connection, table):
+            return {}
+        result = connection.execute(
+            select(*group, func.max(table.c[time_column])).group_by(*group)
+        )
+        return {tuple(row[:-1]): row[-1] for row in result}
+
+
+def read(table, **filters):
+    """
+    Read the rows of a table that match the given filters
+
+    Each filter is a column name and either a value or a list of values.  If the
+    table doesn't exist yet then it has no rows.
+    """
+    with _get_engine().connect() as connection:
+        if not _has_table(connection, table):
+            return []
+        return (
+            connection.execute(select(table).where(*_conditions(table, filters)))
+            .mappings()
+            .all()
+        )
+
+
+def _conditions(table, filters):
+    return [
+        table.c[name].in_(value)
+        if isinstance(value, list | tuple)
+        else table.c[name] == value
+        for name, value in filters.items()
+    ]
+
+
+def _copy(connection, table, rows):
+    """
+    COPY rows into a table, using the psycopg connection underneath SQLAlchemy's
+
+    This runs in the same transaction as anything else on the connection.
+    """
+    columns = [c.name for c in table.columns]
+    statement = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table.name),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+    )
+
+    count = 0
+    with connection.connection.cursor() as cursor, cursor.copy(statement) as copy:
+        for row in rows:
+            copy.write_row(
+                [row.get(c) for c in columns] if isinstance(row, Mapping) else row
+            )
+            count += 1
+    return count
+
+
+def _copy_in_parallel(table, rows, workers):
+    """
+    COPY rows into a hypertable over several connections at once, each in its own
+    transaction
+
+    We split the rows between the connections by the chunk that they'll go into, so
+    that the connections don't contend for the same chunks.  Rows are streamed to the
+    connections through bounded queues, so we still only hold a few batches of rows at
+    a time.  If any connection fails then we raise its error, and if rows raises an
+    error then all of the connections roll back.  Either way, some of the rows may
+    already have been committed, so this is only for loading a table that's thrown
+    away on failure, like replace_table's shadow table.
+    """
+    time_index = [c.name for c in table.columns].index("time")
+    interval = table.info.get("hypertable", {}).get(
+        "chunk_time_interval", CHUNK_TIME_INTERVAL
+    )
+
+    def worker(q):
+        with _get_engine().begin() as connection:
+            return _copy(connection, table, _from_queue(q))
+
+    queues = [queue.Queue(maxsize=WRITE_QUEUE_SIZE) for _ in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker, q) for q in queues]
+        batches = [[] for _ in range(workers)]
+        try:
+            for row in rows:
+                time = row["time"] if isinstance(row, Mapping) else row[time_index]
+                i = _chunk_index(time, interval) % workers
+                batches[i].append(row)
+                if len(batches[i]) >= WRITE_BATCH_SIZE:
+                    _put(queues[i], batches[i], futures[i])
+                    batches[i] = []
+            for q, batch, future in zip(queues, batches, futures):
+                _put(q, batch, future)
+        except BaseException:
+            for q, future in zip(queues, futures):
+                _put(q, _ABORT, future, check=False)
+            raise
+
+        for q, future in zip(queues, futures):
+            _put(q, None, future, check=False)
+        count = sum(future.result() for future in futures)
+
+    log.debug("Copied %s rows over %s connections", count, workers, table=table.name)
+    return count
+
+
+def _chunk_index(time, interval):
+    """
+    Get the index of the chunk that a time goes into
+
+    TimescaleDB lines chunks up with the Unix epoch.  Our times are dates, or midnight
+    in UTC with or without a timezone, so we can ignore their timezones.
+    """
+    if not isinstance(time, datetime.datetime):
+        time = datetime.datetime.combine(time, datetime.time())
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+    return (time.replace(tzinfo=datetime.UTC) - epoch) // interval
+
+
+# Tells a connection loading rows from a queue to roll back
+_ABORT = object()
+
+
+class _Aborted(Exception):
+    pass
+
+
+def _from_queue(q):
+    while (batch := q.get()) is not None:
+        if batch is _ABORT:
+            raise _Aborted
+        yield from batch
+
+
+def _put(q, batch, future, check=True):
+    """
+    Put a batch on a connection's queue, unless the connection has failed
+
+    If the connection has failed then it's stopped taking batches off its queue, so
+    we'd wait forever for room.  We raise its error, unless check is False.
+    """
+    while True:
+        try:
+            q.put(batch, timeout=1)
+            return
+        except queue.Full:
+            if future.done():
+                if check:
+                    future.result()
+                return
+
+
+def _renamed(table, name):
+    """
+    Copy a table's definition under another name
+
+    The copy doesn't have the table's weekly aggregate, which belongs to the original.
+    """
+    copy = table.to_metadata(MetaData(), name=name)
+    copy.info.pop("weekly_aggregate", None)
+    return copy
+
+
+def _create_weekly_aggregate(connection, table):
+    """
+    Create a TimescaleDB continuous aggregate of a table by week, if it has one
+
+    Tables declare their weekly aggregates in their info, with the aggregate's name and
+    the column that holds their values.  The aggregate has a row for each week and
+    each combination of the values of the table's other primary key columns, with:
+
+      * last_value: the last value in the week, for gauges
+      * last_day: the day of the last value in the week
+      * total: the sum of the values in the week, for counts
+
+    A gauge's rows don't all have values on every day, so to get the last value of a
+    sum of rows in a week we need to sum the last values with the latest last_day.  See
+    the queries/*-weekly.sql queries.
+
+    The aggregate is created without data, and is refreshed after each write.  Until
+    then, TimescaleDB fills in the weeks that haven't been materialised from the table.
+    """
+    aggregate = table.info.get("weekly_aggregate")
+    if not aggregate:
+        return
+
+    columns = ", ".join(
+        f'"{c.name}"' for c in table.primary_key.columns if c.name != "time"
+    )
+    value = f'"{aggregate["value"]}"'
+    connection.execute(
+        text(
+            f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {aggregate["name"]}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT
+              time_bucket('1 week', time, TIMESTAMPTZ '{WEEK_ORIGIN} UTC') AS bucket,
+              {columns},
+              last({value}, time) AS last_value,
+              max(time) AS last_day,
+              sum({value}) AS total
+            FROM {table.name}
+            GROUP BY bucket, {columns}
+            WITH NO DATA
+            """
+        )
+    )
+
+
+def _drop_weekly_aggregate(connection, table):
+    aggregate = table.info.get("weekly_aggregate")
+    if aggregate:
+        connection.execute(
+            text(f"DROP MATERIALIZED VIEW IF EXISTS {aggregate['name']}")
+        )
+
+
+def _refresh_weekly_aggregate(table):
+    """
+    Materialise the weeks of a table's weekly aggregate that have changed
+
+    TimescaleDB tracks which weeks writes to the table have touched, so this only
+    recomputes those.  It can't be run inside a transaction.
+    """
+    aggregate = table.info.get("weekly_aggregate")
+    if not aggregate:
+        return
+
+    engine = _get_engine().execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(
+            text(
+                f"CALL refresh_continuous_aggregate('{aggregate['name']}', NULL, NULL)"
             )
-            connection.execute(insert_stmt)
-            log.info("Inserted %s rows", len(values), table=table.name)
+        )
+        log.debug("Refreshed weekly aggregate", table=table.name)
 
 
-def _batch_size(table):
-    max_params = 65535  # limit for postgresql
-    return max_params // len(table.columns)
+def _create_staging_table(connection, table, columns=None):
+    """
+    Create a temporary table with the same columns as table (or the given subset of
+    them), that's dropped at the end of the current transaction
+    """
+    staging = Table(
+        f"{table.name}_staging",
+        MetaData(),
+        *[Column(c.name, c.type) for c in columns or table.columns],
+        prefixes=["TEMPORARY"],
+        postgresql_on_commit="DROP",
+    )
+    staging.create(connection)
+    return staging
 
 
 def _drop_table(connection, table, batch_size):
@@ -95,6 +544,83 @@ def _drop_table(connection, table, batch_size):
     log.debug("Removed raw table", table=table.name)
 
 
+def _drop_table_in_chunks(table):
+    """
+    Drop a table, dropping each of a hypertable's child tables in its own transaction
+
+    Dropping a hypertable takes a lock on every one of its child tables at once, and we
+    have limited shared memory in our hosted database.
+    """
+    engine = _get_engine()
+    with engine.connect() as connection:
+        if not _has_table(connection, table):
+            return
+        child_tables = _child_tables(connection, table)
+
+    _forget_table(table)
+    for child_table in child_tables:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {child_table}"))
+
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE {table.name}"))
+
+    log.debug("Dropped table", table=table.name)
+
+
+def _ensure_table_once(connection, table):
+    """
+    Make sure that a table exists, unless we've already done so
+
+    We remember that we've done so once the connection's transaction is committed.
+    """
+    engine = connection.engine
+    if table.name in _ready_tables.get(engine, ()):
+        return
+
+    _ensure_table(connection, table)
+    event.listen(
+        connection,
+        "commit",
+        lambda _: _ready_tables.setdefault(engine, set()).add(table.name),
+        once=True,
+    )
+
+
+def _forget_table(table):
+    """
+    Forget that we've made sure that a table exists, because we're about to drop it or
+    swap it for another table
+    """
+    _ready_tables.get(_get_engine(), set()).discard(table.name)
+
+
+def _rename_table(connection, name, new_name):
+    """
+    Rename a table, and the indexes (including the primary key) named after it
+
+    The indexes need renaming too, otherwise the next shadow table's indexes would
+    clash with them.
+    """
+    indexes = connection.scalars(
+        text(
+            """
+            SELECT indexname
+            FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = :name
+            """
+        ),
+        {"name": name},
+    ).all()
+
+    connection.execute(text(f"ALTER TABLE {name} RENAME TO {new_name}"))
+
+    for index in indexes:
+        if index.startswith(name):
+            new_index = new_name + index.removeprefix(name)
+            connection.execute(text(f"ALTER INDEX {index} RENAME TO {new_index}"))
+
+
 def _has_table(connection, table):
     return inspect(connection).has_table(table.name)
 
@@ -124,39 +650,127 @@ def _delete_rows(connection, table, batch_size=10000):
 
 
 def _drop_child_tables(connection, table):
+    tables = _child_tables(connection, table)
+
+    for batch in batched(tables, 100):
+        tables = ", ".join(batch)
+        connection.execute(text(f"DROP TABLE IF EXISTS {tables}"))
+
+
+def _child_tables(connection, table):
+    # TimescaleDB keeps the child tables (chunks) in its own schema, so we cast to
+    # regclass to get names that are qualified with it
     sql = text(
-        f"""
+        """
         SELECT
-          child.relname AS child
+          inhrelid::regclass::text AS child
         FROM
           pg_inherits
-          JOIN pg_class AS child ON (inhrelid = child.oid)
           JOIN pg_class AS parent ON (inhparent = parent.oid)
         WHERE
-          parent.relname = '{table.name}'
+          parent.relname = :name
         """,
     )
-    tables = connection.scalars(sql)
-
-    for batch in batched(tables, 100):
-        tables = ", ".join(batch)
-        connection.execute(text(f"DROP TABLE IF EXISTS {tables}"))
+    return connection.scalars(sql, {"name": table.name}).all()
 
 
 def _ensure_table(connection, table):
+    is_new = not _has_table(connection, table)
     connection.execute(schema.CreateTable(table, if_not_exists=True))
 
     if _is_hypertable(table):
+        settings = table.info.get("hypertable", {})
+        chunk_time_interval = (
+            ", chunk_time_interval => :chunk_time_interval"
+            if "chunk_time_interval" in settings
+            else ""
+        )
         connection.execute(
             text(
-                f"SELECT create_hypertable('{table.name}', 'time', if_not_exists => TRUE);"
+                f"SELECT create_hypertable('{table.name}', 'time', if_not_exists => TRUE"
+                f"{chunk_time_interval});"
+            ),
+            {"chunk_time_interval": settings.get("chunk_time_interval")},
+        )
+        if is_new:
+            _configure_compression(connection, table)
+        _create_weekly_aggregate(connection, table)
+
+
+def _configure_compression(connection, table):
+    """
+    Turn on compression for a new hypertable, if its settings ask for it
+
+    Tables declare their hypertable settings in their info.  A compressed chunk's rows
+    are grouped by the compress_segmentby columns and sorted by compress_orderby.  We
+    only do this when we create the table, because changing a table's compression
+    settings means decompressing it first.  This doesn't compress any chunks: see
+    _compress_old_chunks.
+    """
+    settings = table.info.get("hypertable", {})
+    if "compress_after" not in settings:
+        return
+
+    segmentby = ", ".join(settings.get("compress_segmentby", []))
+    orderby = settings.get("compress_orderby", "time DESC")
+    connection.execute(
+        text(
+            f"""
+            ALTER TABLE {table.name} SET (
+              timescaledb.compress,
+              timescaledb.compress_segmentby = '{segmentby}',
+              timescaledb.compress_orderby = '{orderby}'
             )
+            """
         )
+    )
+    log.debug("Configured compression", table=table.name)
+
+
+def _compress_old_chunks(table):
+    """
+    Compress the chunks of a hypertable whose rows are all older than compress_after
+
+    We do this to replace_table's shadow table before we swap it in, rather than adding
+    a compression policy.  Most of our tables are replaced every night, and a policy
+    would compress the new table's old chunks after it had been swapped in, only for
+    the table to be thrown away the next night.  Tables that are updated in place (see
+    INCREMENTAL_METRICS) have their old chunks compressed the next time they're
+    replaced.
+
+    We compress each chunk in its own transaction, because we have limited shared
+    memory in our hosted database.
+    """
+    settings = table.info.get("hypertable", {})
+    if "compress_after" not in settings:
+        return
+
+    engine = _get_engine()
+    with engine.connect() as connection:
+        chunks = connection.scalars(
+            text(
+                f"SELECT show_chunks('{table.name}', "
+                f"older_than => INTERVAL '{settings['compress_after']}')::text"
+            )
+        ).all()
+
+    for chunk in chunks:
+        with engine.begin() as connection:
+            connection.execute(text(f"SELECT compress_chunk('{chunk}')"))
+
+    log.debug("Compressed %s chunks", len(chunks), table=table.name)
 
 
 @functools.cache
 def _get_engine():
-    engine = create_engine(_get_url())
+    # Whatever uses the database from several threads at once sizes the pool for them,
+    # by setting DB_POOL_SIZE before the engine is created (see metrics.tasks.__main__)
+    pool = (
+        {"pool_size": int(os.environ["DB_POOL_SIZE"])}
+        if "DB_POOL_SIZE" in os.environ
+        else {}
+    )
+    engine = create_engine(_get_url(), **pool)
     atexit.register(engine.dispose)
     return engine
 
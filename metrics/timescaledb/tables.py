@@ -1,9 +1,23 @@
+import datetime
+
 from sqlalchemy import TIMESTAMP, Boolean, Column, Integer, MetaData, Table, Text
 
 
 metadata = MetaData()
 
 
+# Hypertable settings for tables with a row per day for each repo, which are applied
+# when the table is created.  Once a day has passed we rarely write to it again, so
+# when the table is replaced its older chunks are compressed, with the rows for each
+# repo compressed together.
+DAILY_PER_REPO = {
+    "chunk_time_interval": datetime.timedelta(days=90),
+    "compress_segmentby": ["organisation", "repo"],
+    "compress_orderby": "time DESC",
+    "compress_after": "180 days",
+}
+
+
 GitHubCodespaces = Table(
     "github_codespaces",
     metadata,
@@ -33,6 +47,37 @@ GitHubPullRequests = Table(
     Column("is_content", Boolean, primary_key=True),
     Column("organisation", Text, primary_key=True),
     Column("repo", Text, primary_key=True),
+    info={
+        "hypertable": DAILY_PER_REPO,
+        "weekly_aggregate": {"name": "github_pull_requests_weekly", "value": "value"},
+    },
+)
+
+
+# The raw PRs that we've fetched from GitHub, so that we only need to fetch the PRs
+# that have been updated since we last fetched them
+GitHubPullRequestStore = Table(
+    "github_pull_request_store",
+    metadata,
+    Column("organisation", Text, primary_key=True),
+    Column("repo", Text, primary_key=True),
+    Column("number", Integer, primary_key=True),
+    Column("author", Text),
+    Column("created_at", TIMESTAMP(timezone=True)),
+    Column("closed_at", TIMESTAMP(timezone=True)),
+    Column("merged_at", TIMESTAMP(timezone=True)),
+    Column("updated_at", TIMESTAMP(timezone=True)),
+)
+
+
+# The time up to which we've synced each repo's PRs into the store; none of the repo's
+# PRs was updated between its latest stored update and then
+GitHubPullRequestSyncs = Table(
+    "github_pull_request_syncs",
+    metadata,
+    Column("organisation", Text, primary_key=True),
+    Column("repo", Text, primary_key=True),
+    Column("synced_at", TIMESTAMP(timezone=True)),
 )
 
 
@@ -46,6 +91,7 @@ GitHubVulnerabilities = Table(
     Column("organisation", Text, primary_key=True),
     Column("repo", Text, primary_key=True),
     Column("has_alerts_enabled", Boolean),
+    info={"hypertable": DAILY_PER_REPO},
 )
 
 
@@ -57,6 +103,10 @@ GitHubIssues = Table(
     Column("repo", Text, primary_key=True),
     Column("author", Text, primary_key=True),
     Column("count", Integer),
+    info={
+        "hypertable": DAILY_PER_REPO,
+        "weekly_aggregate": {"name": "github_issues_weekly", "value": "count"},
+    },
 )
 
 
@@ -66,4 +116,5 @@ SlackTechSupport = Table(
     Column("time", TIMESTAMP(timezone=True), primary_key=True),
     Column("name", Text, primary_key=True),
     Column("value", Integer),
+    info={"hypertable": {"chunk_time_interval": datetime.timedelta(days=365)}},
 )
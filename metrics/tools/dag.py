@@ -0,0 +1,50 @@
+import graphlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def run(tasks, dependencies, max_workers):
+    """
+    Run tasks concurrently, each once all of the tasks that it depends on have succeeded
+
+    tasks maps names to functions that take no arguments, and dependencies maps names
+    to the names of the tasks that they depend on.  A task fails if its function raises
+    an exception, and the tasks that depend on a task that fails are skipped, as are
+    the tasks that depend on them.  Dependencies on names that aren't in tasks are
+    ignored, so that a task can be run on its own.
+
+    Returns a dict of the outcome of each task: OK, FAILED or SKIPPED.
+    """
+    graph = {
+        name: [dep for dep in dependencies.get(name, []) if dep in tasks]
+        for name in tasks
+    }
+    sorter = graphlib.TopologicalSorter(graph)
+    sorter.prepare()  # raises graphlib.CycleError if there's a cycle
+
+    outcomes = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while sorter.is_active():
+            while ready := sorter.get_ready():
+                for name in ready:
+                    if all(outcomes[dep] == OK for dep in graph[name]):
+                        running[executor.submit(tasks[name])] = name
+                    else:
+                        outcomes[name] = SKIPPED
+                        sorter.done(name)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                outcomes[name] = FAILED if future.exception() else OK
+                sorter.done(name)
+
+    return outcomes
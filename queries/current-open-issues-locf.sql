@@ -0,0 +1,68 @@
+WITH
+  last_saturday AS (
+    SELECT CURRENT_DATE - (1 + CAST(extract(dow FROM CURRENT_DATE) AS INT)) % 7 as the_date
+  ),
+  open_issues_only AS (
+    SELECT time, organisation, repo, author, count
+    FROM github_issues
+  ),
+  in_timeframe AS (
+    -- We only store the days on which each count changes (see GAUGE_CHANGE_POINTS),
+    -- so we start each count at its last change before the time range, carry the
+    -- counts forward to fill in every day, and then drop the days with no count,
+    -- which aren't stored when we store every day.
+    SELECT day AS time, organisation, repo, author, count
+    FROM (
+      SELECT
+        time_bucket_gapfill('1 day', time, $__timeFrom()::timestamptz, $__timeTo()::timestamptz) AS day,
+        organisation, repo, author,
+        locf(last(count, time)) AS count
+      FROM (
+        SELECT time, organisation, repo, author, count
+        FROM open_issues_only
+        WHERE time > $__timeFrom()::timestamptz AND time <= $__timeTo()::timestamptz
+        UNION ALL
+        (
+          SELECT DISTINCT ON (organisation, repo, author)
+            $__timeFrom()::timestamptz AS time, organisation, repo, author, count
+          FROM open_issues_only
+          WHERE time <= $__timeFrom()::timestamptz
+          ORDER BY organisation, repo, author, time DESC
+        )
+      ) AS changes
+      GROUP BY day, organisation, repo, author
+    ) AS daily
+    WHERE day >= $__timeFrom()::timestamptz AND count > 0
+  ),
+  fields_munged AS (
+    -- the time field is a timestamp, but we only ever write midnight;
+    -- we need to keep it as a timestamp type for bucketing below
+    SELECT time as day, organisation||'/'||repo AS repo, author, count
+    FROM in_timeframe
+  ),
+  authors_aggregated AS (
+    SELECT day, repo, sum(count) as count
+    FROM fields_munged
+    GROUP BY day, repo
+  ),
+  partial_week_ignored AS (
+    SELECT day, repo, count
+    FROM authors_aggregated, last_saturday
+    WHERE day < last_saturday.the_date
+  ),
+  bucketed_in_weeks AS (
+    SELECT
+      -- label buckets with the (exclusive) end date;
+      -- the 'origin' argument can be _any_ Saturday
+      time_bucket('1 week', day, last_saturday.the_date) + '7 days' as bucket,
+      repo,
+      -- aggregate by taking the last value because this is a gauge, not a count
+      last(count, day) as count
+    FROM
+      partial_week_ignored, last_saturday
+    GROUP BY bucket, repo
+  )
+SELECT repo as "Repo", count AS "Open issues"
+FROM bucketed_in_weeks
+ORDER BY bucket DESC, count DESC
+LIMIT 10
@@ -0,0 +1,78 @@
+WITH
+  last_saturday AS (
+    SELECT CURRENT_DATE - (1 + CAST(extract(dow FROM CURRENT_DATE) AS INT)) % 7 as the_date
+  ),
+  old_prs_only AS (
+    SELECT time, organisation, repo, author, is_content, value
+    FROM github_pull_requests
+    WHERE name = 'queue_older_than_7_days'
+  ),
+  in_timeframe AS (
+    -- We only store the days on which each count changes (see GAUGE_CHANGE_POINTS),
+    -- so we start each count at its last change before the time range, carry the
+    -- counts forward to fill in every day, and then drop the days with no count,
+    -- which aren't stored when we store every day.
+    SELECT day AS time, organisation, repo, author, is_content, value
+    FROM (
+      SELECT
+        time_bucket_gapfill('1 day', time, $__timeFrom()::timestamptz, $__timeTo()::timestamptz) AS day,
+        organisation, repo, author, is_content,
+        locf(last(value, time)) AS value
+      FROM (
+        SELECT time, organisation, repo, author, is_content, value
+        FROM old_prs_only
+        WHERE time > $__timeFrom()::timestamptz AND time <= $__timeTo()::timestamptz
+        UNION ALL
+        (
+          SELECT DISTINCT ON (organisation, repo, author, is_content)
+            $__timeFrom()::timestamptz AS time, organisation, repo, author, is_content, value
+          FROM old_prs_only
+          WHERE time <= $__timeFrom()::timestamptz
+          ORDER BY organisation, repo, author, is_content, time DESC
+        )
+      ) AS changes
+      GROUP BY day, organisation, repo, author, is_content
+    ) AS daily
+    WHERE day >= $__timeFrom()::timestamptz AND value > 0
+  ),
+  fields_munged AS (
+    -- the time field is a timestamp, but we only ever write midnight;
+    -- we need to keep it as a timestamp type for bucketing below
+    SELECT time as day, organisation||'/'||repo AS repo, author, is_content, value as num_prs
+    FROM in_timeframe
+  ),
+  dependabot_removed AS (
+    SELECT day, repo, author, is_content, num_prs
+    FROM fields_munged
+    WHERE author NOT LIKE 'dependabot%'
+  ),
+  just_content AS (
+    SELECT day, repo, author, num_prs
+    FROM dependabot_removed
+    WHERE is_content
+  ),
+  authors_aggregated AS (
+    SELECT day, repo, sum(num_prs) as num_prs
+    FROM just_content
+    GROUP BY day, repo
+  ),
+  partial_week_ignored AS (
+    SELECT day, repo, num_prs
+    FROM authors_aggregated, last_saturday
+    WHERE day < last_saturday.the_date
+  ),
+  bucketed_in_weeks AS (
+    SELECT
+      -- label buckets with the (exclusive) end date;
+      -- the 'origin' argument can be _any_ Saturday
+      time_bucket('1 week', day, last_saturday.the_date) + '7 days' as bucket,
+      repo,
+      -- aggregate by taking the last value because this is a gauge, not a count
+      last(num_prs, day) as num_prs
+    FROM
+      partial_week_ignored, last_saturday
+    GROUP BY bucket, repo
+  )
+SELECT bucket, repo, num_prs
+FROM bucketed_in_weeks
+ORDER BY bucket DESC, repo
@@ -0,0 +1,48 @@
+-- Like open-issues.sql, but reading weekly rows from the github_issues_weekly
+-- continuous aggregate rather than scanning every day (see DEVELOPERS.md).
+-- The timeframe selects whole weeks, by the day that they start.
+WITH
+  last_saturday AS (
+    SELECT CURRENT_DATE - (1 + CAST(extract(dow FROM CURRENT_DATE) AS INT)) % 7 as the_date
+  ),
+  issues AS (
+    SELECT bucket, organisation, repo, author, last_value, last_day
+    FROM github_issues_weekly
+  ),
+  in_timeframe AS (
+    SELECT bucket, organisation, repo, author, last_value, last_day
+    FROM issues
+    WHERE $__timeFilter(bucket)
+  ),
+  fields_munged AS (
+    SELECT bucket, organisation||'/'||repo AS repo, author, last_value as count, last_day
+    FROM in_timeframe
+  ),
+  partial_week_ignored AS (
+    -- weeks start on Saturdays, so a week that starts before the last Saturday is whole
+    SELECT bucket, repo, count, last_day
+    FROM fields_munged, last_saturday
+    WHERE bucket < last_saturday.the_date
+  ),
+  last_days AS (
+    -- each row's last value is from the last day in the week that it has a row for,
+    -- and the last value of the sum is the sum of the rows on the group's last day
+    SELECT
+      bucket, repo, count, last_day,
+      max(last_day) OVER (PARTITION BY bucket, repo) AS group_last_day
+    FROM partial_week_ignored
+  ),
+  bucketed_in_weeks AS (
+    SELECT
+      -- label buckets with the (exclusive) end date
+      bucket + '7 days' as bucket,
+      repo,
+      -- aggregate by taking the last value because this is a gauge, not a count
+      sum(count) as count
+    FROM last_days
+    WHERE last_day = group_last_day
+    GROUP BY bucket, repo
+  )
+SELECT bucket, repo, count
+FROM bucketed_in_weeks
+ORDER BY bucket DESC, repo
@@ -0,0 +1,49 @@
+-- Like throughput-humals.sql, but reading weekly rows from the github_pull_requests_weekly
+-- continuous aggregate rather than scanning every day (see DEVELOPERS.md).
+-- The timeframe selects whole weeks, by the day that they start.
+WITH
+  last_saturday AS (
+    SELECT CURRENT_DATE - (1 + CAST(extract(dow FROM CURRENT_DATE) AS INT)) % 7 as the_date
+  ),
+  throughputs_only AS (
+    SELECT bucket, organisation, repo, author, is_content, total
+    FROM github_pull_requests_weekly
+    WHERE name = 'prs_merged'
+  ),
+  in_timeframe AS (
+    SELECT bucket, organisation, repo, author, is_content, total
+    FROM throughputs_only
+    WHERE $__timeFilter(bucket)
+  ),
+  fields_munged AS (
+    SELECT bucket, organisation||'/'||repo AS repo, author, is_content, total as throughput
+    FROM in_timeframe
+  ),
+  dependabot_removed AS (
+    SELECT bucket, repo, author, is_content, throughput
+    FROM fields_munged
+    WHERE author NOT LIKE 'dependabot%'
+  ),
+  content_ignored AS (
+    SELECT bucket, repo, author, throughput
+    FROM dependabot_removed
+    WHERE NOT is_content
+  ),
+  partial_week_ignored AS (
+    -- weeks start on Saturdays, so a week that starts before the last Saturday is whole
+    SELECT bucket, repo, throughput
+    FROM content_ignored, last_saturday
+    WHERE bucket < last_saturday.the_date
+  ),
+  bucketed_in_weeks AS (
+    SELECT
+      -- label buckets with the (exclusive) end date
+      bucket + '7 days' as bucket,
+      repo, -- aggregate by taking the sum because this is a count, not a gauge
+      sum(throughput) as throughput
+    FROM partial_week_ignored
+    GROUP BY bucket, repo
+  )
+SELECT bucket, repo, throughput
+FROM bucketed_in_weeks
+ORDER BY bucket DESC, repo
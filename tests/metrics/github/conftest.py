@@ -0,0 +1,23 @@
+import pytest
+
+from metrics.github import github, snapshot, sync
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # the tests patch the queries with different results, so don't let one test see
+    # another's repos, teams, search results or snapshot directory
+    github.clear_cache()
+    snapshot.clear_cache()
+    sync.clear_cache()
+    yield
+    github.clear_cache()
+    snapshot.clear_cache()
+    sync.clear_cache()
+
+
+@pytest.fixture(autouse=True)
+def no_snapshots(monkeypatch):
+    # don't let a developer's environment make the tests record or replay snapshots
+    monkeypatch.delenv("GITHUB_SNAPSHOT_DIR", raising=False)
+    monkeypatch.delenv("GITHUB_FROM_SNAPSHOT", raising=False)
@@ -0,0 +1,55 @@
+from metrics.github import cache
+from metrics.github.cache import Entry, ResponseCache
+
+
+def test_get_returns_what_was_put(tmp_path):
+    c = ResponseCache(tmp_path / "cache.sqlite")
+    c.put("a-token", "https://the-url", Entry("the-etag", "[1, 2]", "https://next"))
+
+    assert c.get("a-token", "https://the-url") == Entry(
+        "the-etag", "[1, 2]", "https://next"
+    )
+
+
+def test_entries_are_keyed_by_token_and_url(tmp_path):
+    c = ResponseCache(tmp_path / "cache.sqlite")
+    c.put("a-token", "https://the-url", Entry("the-etag", "[]", None))
+
+    assert c.get("another-token", "https://the-url") is None
+    assert c.get("a-token", "https://another-url") is None
+
+
+def test_entries_persist(tmp_path):
+    ResponseCache(tmp_path / "cache.sqlite").put(
+        "a-token", "https://the-url", Entry("the-etag", "[]", None)
+    )
+
+    c = ResponseCache(tmp_path / "cache.sqlite")
+    assert c.get("a-token", "https://the-url") == Entry("the-etag", "[]", None)
+
+
+def test_unused_entries_expire(tmp_path, monkeypatch):
+    c = ResponseCache(tmp_path / "cache.sqlite", ttl=10)
+
+    monkeypatch.setattr(cache.time, "time", lambda: 1000)
+    c.put("a-token", "https://old-url", Entry("the-etag", "[]", None))
+    c.put("a-token", "https://used-url", Entry("the-etag", "[]", None))
+
+    monkeypatch.setattr(cache.time, "time", lambda: 1005)
+    c.touch("a-token", "https://used-url")
+
+    monkeypatch.setattr(cache.time, "time", lambda: 1012)
+    assert c.get("a-token", "https://old-url") is None
+    assert c.get("a-token", "https://used-url") is not None
+
+
+def test_evicts_least_recently_used_entries_when_full(tmp_path, monkeypatch):
+    c = ResponseCache(tmp_path / "cache.sqlite", max_size=10)
+
+    for i, url in enumerate(["https://a", "https://b", "https://c"]):
+        monkeypatch.setattr(cache.time, "time", lambda now=1000 + i: now)
+        c.put("a-token", url, Entry("the-etag", "1234", None))
+
+    assert c.get("a-token", "https://a") is None
+    assert c.get("a-token", "https://b") is not None
+    assert c.get("a-token", "https://c") is not None
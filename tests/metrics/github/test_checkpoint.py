@@ -0,0 +1,66 @@
+from metrics.github import checkpoint
+from metrics.github.checkpoint import Checkpoint, CheckpointStore
+
+
+QUERY = ("graphql", "a query", ["path"], None, {"org": "an-org"})
+
+
+def test_replays_pages_that_were_added(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoints.sqlite")
+    store.add_page(QUERY, [1, 2], "cursor-1")
+    store.add_page(QUERY, [3], "cursor-2")
+
+    c = CheckpointStore(tmp_path / "checkpoints.sqlite").get(QUERY)
+    assert c == Checkpoint(pages=2, position="cursor-2", done=False)
+    assert list(store.nodes(QUERY, c)) == [1, 2, 3]
+
+
+def test_last_page_finishes_query(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoints.sqlite")
+    store.add_page(QUERY, [1], None)
+
+    assert store.get(QUERY) == Checkpoint(pages=1, position=None, done=True)
+
+
+def test_queries_are_keyed_by_their_variables(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoints.sqlite")
+    store.add_page(QUERY, [1], None)
+
+    assert store.get(QUERY[:-1] + ({"org": "another-org"},)) is None
+
+
+def test_old_checkpoints_expire(tmp_path, monkeypatch):
+    store = CheckpointStore(tmp_path / "checkpoints.sqlite", ttl=10)
+
+    monkeypatch.setattr(checkpoint.time, "time", lambda: 1000)
+    store.add_page(QUERY, [1], "cursor-1")
+    monkeypatch.setattr(checkpoint.time, "time", lambda: 1005)
+    store.add_page(QUERY, [2], "cursor-2")
+
+    # a checkpoint expires a while after the query's first page, however recent the
+    # latest page is
+    monkeypatch.setattr(checkpoint.time, "time", lambda: 1011)
+    assert store.get(QUERY) is None
+
+    store.add_page(QUERY, [3], None)
+    c = store.get(QUERY)
+    assert list(store.nodes(QUERY, c)) == [3]
+
+
+def test_clear(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoints.sqlite")
+    store.add_page(QUERY, [1], None)
+    store.clear()
+
+    assert store.get(QUERY) is None
+
+
+def test_delete(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoints.sqlite")
+    store.add_page(QUERY, [1], None)
+    other = ("graphql", "a query", ["path"], None, {"org": "another-org"})
+    store.add_page(other, [2], None)
+    store.delete(QUERY)
+
+    assert store.get(QUERY) is None
+    assert store.get(other) is not None
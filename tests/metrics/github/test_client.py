@@ -0,0 +1,289 @@
+import threading
+import time
+
+from metrics.github import client
+from metrics.github.cache import ResponseCache
+from metrics.github.checkpoint import CheckpointStore
+from metrics.github.client import GitHubClient, concurrently
+
+
+def test_concurrently_yields_results_in_order_of_args():
+    def fetch(delay, value):
+        time.sleep(delay)
+        return iter([value, value])
+
+    results = concurrently(fetch, [(0.03, "a"), (0.02, "b"), (0.0, "c")])
+
+    assert list(results) == [["a", "a"], ["b", "b"], ["c", "c"]]
+
+
+def test_concurrently_runs_calls_at_the_same_time():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fetch(value):
+        # this would time out if the calls were made one after another
+        barrier.wait()
+        return [value]
+
+    assert list(concurrently(fetch, [(1,), (2,), (3,)], max_workers=3)) == [
+        [1],
+        [2],
+        [3],
+    ]
+
+
+def test_concurrently_limits_calls_in_flight():
+    started = []
+
+    def fetch(value):
+        started.append(value)
+        return [value]
+
+    results = concurrently(fetch, [(i,) for i in range(10)], max_workers=2)
+    assert next(results) == [0]
+
+    # we've consumed one result, so at most two more calls can have been made
+    assert len(started) <= 3
+    assert list(results) == [[i] for i in range(1, 10)]
+
+
+def test_limits_concurrent_requests_per_token(monkeypatch):
+    lock = threading.Lock()
+    in_flight = {"a-token": 0, "b-token": 0}
+    max_in_flight = {"a-token": 0, "b-token": 0}
+
+    def fake_request(method, url, headers, json):
+        token = headers["Authorization"].removeprefix("bearer ")
+        with lock:
+            in_flight[token] += 1
+            max_in_flight[token] = max(max_in_flight[token], in_flight[token])
+        time.sleep(0.01)
+        with lock:
+            in_flight[token] -= 1
+        return FakeResponse({"data": {"org": json["variables"]["org"]}})
+
+    github = GitHubClient(
+        tokens={"a-org": "a-token", "b-org": "b-token"}, max_requests_per_token=2
+    )
+    monkeypatch.setattr(github.session, "request", fake_request)
+
+    def fetch(org):
+        return [github.graphql_query_page("query", cursor=None, org=org)]
+
+    args = [("a-org",), ("b-org",)] * 6
+    results = list(concurrently(fetch, args, max_workers=12))
+
+    assert results == [[{"org": org}] for (org,) in args]
+    assert max_in_flight["a-token"] <= 2
+    assert max_in_flight["b-token"] <= 2
+
+
+def test_connection_pool_holds_a_connection_per_concurrent_request():
+    def pool_size(github):
+        return github.session.get_adapter("https://api.github.com")._pool_maxsize
+
+    github = GitHubClient(token="a-token", max_requests_per_token=2)
+    assert pool_size(github) == 2
+
+    github = GitHubClient(
+        tokens={"a-org": "a-token", "b-org": "b-token", "c-org": "a-token"},
+        max_requests_per_token=2,
+    )
+    assert pool_size(github) == 4
+
+
+def test_retries_when_secondary_rate_limited(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(client.time, "sleep", sleeps.append)
+
+    responses = iter(
+        [
+            FakeResponse(
+                {}, status_code=403, text="You have exceeded a secondary rate limit"
+            ),
+            FakeResponse({}, status_code=429, headers={"Retry-After": "30"}),
+            FakeResponse({"data": {"the": "data"}}),
+        ]
+    )
+    variables = []
+
+    def fake_request(method, url, headers, json):
+        variables.append(json["variables"])
+        return next(responses)
+
+    github = GitHubClient(token="a-token")
+    monkeypatch.setattr(github.session, "request", fake_request)
+    assert github.graphql_query_page("query", cursor="the-cursor") == {"the": "data"}
+
+    # we back off exponentially, unless we're told how long to wait
+    assert [s for s in sleeps if s] == [client.BACKOFF_SECONDS, 30]
+    # and we're still on the same page
+    assert variables == [{"cursor": "the-cursor"}] * 3
+
+
+def test_waits_for_reset_when_rate_limit_exhausted(monkeypatch):
+    monkeypatch.setattr(client.time, "time", lambda: 1000)
+    response = FakeResponse(
+        {},
+        status_code=403,
+        headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1100"},
+    )
+
+    assert client._retry_delay(response, attempt=0) == 101
+
+
+def test_does_not_retry_other_errors():
+    assert client._retry_delay(FakeResponse({}, status_code=404), attempt=0) is None
+    assert client._retry_delay(FakeResponse({}, status_code=403), attempt=0) is None
+    assert (
+        client._retry_delay(FakeResponse({}, status_code=502), attempt=0)
+        == client.BACKOFF_SECONDS
+    )
+    assert (
+        client._retry_delay(
+            FakeResponse({}, status_code=502), attempt=client.MAX_RETRIES
+        )
+        is None
+    )
+
+
+def test_paces_requests_when_budget_runs_low(monkeypatch):
+    monkeypatch.setattr(client.time, "time", lambda: 1000)
+    monkeypatch.setattr(client, "PACING_THRESHOLD", 10)
+    rate_limits = client.RateLimits()
+
+    # no information about the budget, so no need to wait
+    assert rate_limits.delay("a-token", "graphql") == 0
+
+    rate_limits.update("a-token", rate_limit_response("graphql", 100, reset=1100))
+    assert rate_limits.delay("a-token", "graphql") == 0
+
+    # four requests left to make in the next 100 seconds
+    rate_limits.update("a-token", rate_limit_response("graphql", 4, reset=1100))
+    assert [rate_limits.delay("a-token", "graphql") for _ in range(3)] == [0, 25, 50]
+
+    # the REST API has its own budget
+    assert rate_limits.delay("a-token", "core") == 0
+
+    # exhausted, so wait for the reset
+    rate_limits.update("a-token", rate_limit_response("graphql", 0, reset=1100))
+    assert rate_limits.delay("a-token", "graphql") == 100
+
+
+def test_rest_query_uses_cached_response_when_not_modified(monkeypatch, tmp_path):
+    requests_made = []
+
+    def fake_request(method, url, headers):
+        requests_made.append((url, headers.get("If-None-Match")))
+        if headers.get("If-None-Match") == f"etag-{url}":
+            return FakeResponse(None, status_code=304)
+        return FakeResponse(
+            [url],
+            headers={"ETag": f"etag-{url}"} | next_page_link(url),
+            text=f'["{url}"]',
+        )
+
+    github = GitHubClient(
+        token="a-token", cache=ResponseCache(tmp_path / "cache.sqlite")
+    )
+    monkeypatch.setattr(github.session, "request", fake_request)
+    first = list(github.rest_query("/orgs/{org}/things", org="an-org"))
+    second = list(github.rest_query("/orgs/{org}/things", org="an-org"))
+
+    url = "https://api.github.com/orgs/an-org/things"
+    assert first == second == [url, f"{url}?page=2"]
+    assert requests_made == [
+        (url, None),
+        (f"{url}?page=2", None),
+        (url, f"etag-{url}"),
+        (f"{url}?page=2", f"etag-{url}?page=2"),
+    ]
+
+
+def test_graphql_query_resumes_from_checkpoint(monkeypatch, tmp_path):
+    cursors = []
+    failing = True
+
+    def fake_request(method, url, headers, json):
+        cursor = json["variables"]["cursor"]
+        cursors.append(cursor)
+        if cursor == "2" and failing:
+            raise ConnectionError
+        page = int(cursor or 0)
+        return FakeResponse(
+            {
+                "data": {
+                    "things": {
+                        "nodes": [page],
+                        "pageInfo": {
+                            "endCursor": str(page + 1),
+                            "hasNextPage": page < 2,
+                        },
+                    }
+                }
+            }
+        )
+
+    def fetch(resume=True):
+        github = GitHubClient(
+            token="a-token",
+            checkpoints=CheckpointStore(tmp_path / "checkpoints.sqlite"),
+            resume=resume,
+        )
+        monkeypatch.setattr(github.session, "request", fake_request)
+        return github.graphql_query("query", path=["things"], org="an-org")
+
+    nodes = []
+    try:
+        nodes.extend(fetch())
+    except ConnectionError:
+        pass
+    assert nodes == [0, 1]
+
+    failing = False
+    cursors.clear()
+    assert list(fetch()) == [0, 1, 2]
+    assert cursors == ["2"]
+
+    # once a query has finished, it's replayed without making any requests
+    cursors.clear()
+    assert list(fetch()) == [0, 1, 2]
+    assert cursors == []
+
+    # unless we're not resuming, when it's fetched again
+    cursors.clear()
+    assert list(fetch(resume=False)) == [0, 1, 2]
+    assert cursors == [None, "1", "2"]
+
+
+def next_page_link(url):
+    if url.endswith("?page=2"):
+        return {}
+    return {"Link": f'<{url}?page=2>; rel="next"'}
+
+
+def rate_limit_response(resource, remaining, reset):
+    return FakeResponse(
+        {},
+        headers={
+            "X-RateLimit-Resource": resource,
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(reset),
+        },
+    )
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200, headers=None, text=""):
+        self.data = data
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.text = text
+        self.content = text.encode()
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
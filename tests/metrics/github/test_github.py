@@ -1,4 +1,7 @@
+import concurrent.futures
 import datetime
+import sys
+import time
 
 import pytest
 
@@ -24,6 +27,9 @@ def patch(monkeypatch):
         def fake(*keys):
             r = result
             for key in keys:
+                if isinstance(key, list):
+                    # batched queries return a list of results, one for each key
+                    return [r.get(k, []) for k in key]
                 if key in r:
                     r = r[key]
                 else:
@@ -114,6 +120,47 @@ def test_looks_up_ownership(patch):
     ]
 
 
+def test_fetches_repos_and_teams_once_until_cache_cleared(patch, monkeypatch):
+    patch("repos", {"ebmdatalab": [repo_data("repo1")]})
+    patch("team_repos", {"ebmdatalab": {"team-rex": ["repo1"]}})
+
+    calls = []
+    fake_repos = github.query.repos
+    monkeypatch.setattr(
+        github.query, "repos", lambda org: calls.append(org) or fake_repos(org)
+    )
+
+    github.all_repos()
+    github.tech_repos()
+    assert calls == ["ebmdatalab", "opensafely-core"]
+
+    github.clear_cache()
+    github.all_repos()
+    assert calls == ["ebmdatalab", "opensafely-core"] * 2
+
+
+def test_fetches_repos_once_when_tasks_ask_at_the_same_time(patch, monkeypatch):
+    patch("repos", {"ebmdatalab": [repo_data("repo1")]})
+
+    calls = []
+    fake_repos = github.query.repos
+
+    def slow_repos(org):
+        calls.append(org)
+        time.sleep(0.05)
+        return fake_repos(org)
+
+    monkeypatch.setattr(github.query, "repos", slow_repos)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(lambda _: github._org_repos("ebmdatalab"), range(4))
+        )
+
+    assert calls == ["ebmdatalab"]
+    assert all(result == results[0] for result in results)
+
+
 def test_excludes_archived_non_tech_repos(patch):
     patch("repos", {"ebmdatalab": [repo_data("the_repo", is_archived=True)]})
     patch(
@@ -136,7 +183,10 @@ def test_correctly_labels_non_tech_prs_from_non_content_repos(patch):
     patch("team_members", {"ebmdatalab": {"team-rex": ["tech-person"]}})
     patch("team_repos", {"ebmdatalab": {"team-rex": ["job-server"]}})
     patch("repos", {"ebmdatalab": [repo_data("job-server")]})
-    patch("prs", {"ebmdatalab": {"job-server": [pr_data(author="non-tech-person")]}})
+    patch(
+        "prs_for_repos",
+        {"ebmdatalab": {"job-server": [pr_data(author="non-tech-person")]}},
+    )
 
     prs = github.tech_prs()
     assert len(prs) == 1
@@ -147,7 +197,10 @@ def test_correctly_labels_tech_prs_from_content_repos(patch):
     patch("team_members", {"ebmdatalab": {"team-rex": ["tech-person"]}})
     patch("team_repos", {"ebmdatalab": {"team-rex": ["opensafely.org"]}})
     patch("repos", {"ebmdatalab": [repo_data("opensafely.org")]})
-    patch("prs", {"ebmdatalab": {"opensafely.org": [pr_data(author="tech-person")]}})
+    patch(
+        "prs_for_repos",
+        {"ebmdatalab": {"opensafely.org": [pr_data(author="tech-person")]}},
+    )
 
     prs = github.tech_prs()
     assert len(prs) == 1
@@ -159,7 +212,8 @@ def test_correctly_labels_non_tech_prs_from_content_repos(patch):
     patch("team_repos", {"ebmdatalab": {"team-rex": ["opensafely.org"]}})
     patch("repos", {"ebmdatalab": [repo_data("opensafely.org")]})
     patch(
-        "prs", {"ebmdatalab": {"opensafely.org": [pr_data(author="non-tech-person")]}}
+        "prs_for_repos",
+        {"ebmdatalab": {"opensafely.org": [pr_data(author="non-tech-person")]}},
     )
 
     prs = github.tech_prs()
@@ -167,6 +221,38 @@ def test_correctly_labels_non_tech_prs_from_content_repos(patch):
     assert prs[0].is_content
 
 
+def test_iter_tech_prs_yields_prs_by_repo(patch):
+    patch("team_members", {})
+    patch("team_repos", {"ebmdatalab": {"team-rex": ["repo1", "repo2"]}})
+    patch("repos", {"ebmdatalab": [repo_data("repo1"), repo_data("repo2")]})
+    patch(
+        "prs_for_repos",
+        {"ebmdatalab": {"repo1": [pr_data(), pr_data()], "repo2": [pr_data()]}},
+    )
+
+    prs_by_repo = github.iter_tech_prs()
+
+    assert [(r.name, len(prs)) for r, prs in prs_by_repo] == [
+        ("repo1", 2),
+        ("repo2", 1),
+    ]
+
+
+def test_interns_strings_from_github(patch):
+    patch("team_members", {})
+    patch("team_repos", {"ebmdatalab": {"team-rex": ["repo1"]}})
+    patch("repos", {"ebmdatalab": [repo_data("repo1")]})
+    patch(
+        "prs_for_repos",
+        # build the names at runtime, so they're not the same string to begin with
+        {"ebmdatalab": {"repo1": [pr_data(b"an-author".decode()) for _ in "ab"]}},
+    )
+
+    pr1, pr2 = github.tech_prs()
+    assert pr1.author is pr2.author is sys.intern("an-author")
+    assert not hasattr(pr1, "__dict__")
+
+
 def test_is_old():
     # A PR is old if it was created a week or more ago.
     assert pr(created_on=LONG_AGO).was_old_on(TODAY)
@@ -3,7 +3,7 @@ import datetime
 import pytest
 
 from metrics.github.github import Issue, Repo
-from metrics.github.metrics import calculate_issue_counts
+from metrics.github.metrics import calculate_issue_counts, get_issues_metrics
 
 
 TODAY = datetime.date(year=2023, month=6, day=10)
@@ -99,6 +99,21 @@ def test_returns_counts_by_author():
     }
 
 
+def test_issue_change_points():
+    issues = [
+        issue(created_on=TWO_DAYS_AGO - datetime.timedelta(days=3)),
+        issue(created_on=TWO_DAYS_AGO, closed_on=YESTERDAY),
+    ]
+
+    metrics = get_issues_metrics(issues, change_points=True)
+
+    assert [(m["time"].date(), m["count"]) for m in metrics] == [
+        (TWO_DAYS_AGO - datetime.timedelta(days=3), 1),
+        (TWO_DAYS_AGO, 2),
+        (TODAY, 1),
+    ]
+
+
 def repo(org, name, is_archived=False):
     return Repo(
         org,
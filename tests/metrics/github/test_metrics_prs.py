@@ -3,12 +3,20 @@ import datetime
 import pytest
 
 from metrics.github.github import PR, Repo
-from metrics.github.metrics import calculate_pr_counts
+from metrics.github.metrics import (
+    calculate_merged_pr_counts,
+    calculate_old_pr_counts,
+    calculate_pr_counts,
+    get_pr_metrics,
+    iter_pr_metrics,
+    removed_rows,
+)
 
 
 TODAY = datetime.date(year=2023, month=6, day=10)
 YESTERDAY = datetime.date(year=2023, month=6, day=9)
 TWO_DAYS_AGO = datetime.date(year=2023, month=6, day=8)
+ONE_WEEK = datetime.timedelta(weeks=1)
 
 pytestmark = pytest.mark.freeze_time(TODAY)
 
@@ -98,6 +106,167 @@ def test_distinguishes_content_from_non_content():
     }
 
 
+def test_old_pr_counts_match_predicate():
+    prs = varied_prs()
+
+    assert calculate_old_pr_counts(prs) == calculate_pr_counts(prs, PR.was_old_on)
+
+
+def test_merged_pr_counts_match_predicate():
+    prs = varied_prs()
+
+    assert calculate_merged_pr_counts(prs) == calculate_pr_counts(prs, PR.was_merged_on)
+
+
+def test_counts_overlapping_old_prs():
+    r = repo("an-org", "a-repo")
+    prs = [
+        pr(r, author="an-author", created_on=TODAY - ONE_WEEK),
+        pr(r, author="an-author", created_on=YESTERDAY - ONE_WEEK),
+        pr(r, author="an-author", created_on=TWO_DAYS_AGO - ONE_WEEK, closed_on=TODAY),
+    ]
+
+    assert calculate_old_pr_counts(prs) == {
+        ("an-org", "a-repo", "an-author", False, TWO_DAYS_AGO): 1,
+        ("an-org", "a-repo", "an-author", False, YESTERDAY): 2,
+        ("an-org", "a-repo", "an-author", False, TODAY): 2,
+    }
+
+
+def test_gets_metrics_since_each_repos_day():
+    prs = varied_prs()
+    since = {("an-org", "a-repo"): YESTERDAY}
+
+    assert get_pr_metrics(prs, since) == [
+        m
+        for m in get_pr_metrics(prs)
+        if m["repo"] != "a-repo" or m["time"].date() >= YESTERDAY
+    ]
+
+
+def test_iter_pr_metrics_matches_get_pr_metrics():
+    prs = varied_prs()
+    prs_by_repo = [
+        (r, [pr for pr in prs if pr.repo == r]) for r in {pr.repo for pr in prs}
+    ]
+
+    def key(m):
+        return m["name"], row_key(m)
+
+    assert sorted(iter_pr_metrics(prs_by_repo), key=key) == sorted(
+        get_pr_metrics(prs), key=key
+    )
+
+
+def test_removed_rows_are_matched_on_everything_but_the_value():
+    def row(day, author, value):
+        time = datetime.datetime.combine(day, datetime.time())
+        return {"time": time, "author": author, "value": value}
+
+    previous = [
+        # times come back from the database with a timezone
+        {
+            "time": datetime.datetime(2023, 6, 9, tzinfo=datetime.UTC),
+            "author": "an-author",
+            "value": 1,
+        },
+        row(YESTERDAY, "another-author", 1),
+        row(TODAY, "an-author", 1),
+    ]
+    current = [row(YESTERDAY, "an-author", 2), row(TODAY, "an-author", 1)]
+
+    assert removed_rows(previous, current, "value") == [
+        row(YESTERDAY, "another-author", 1)
+    ]
+
+
+def test_change_points_carried_forward_give_daily_metrics():
+    prs = varied_prs()
+    dense = get_pr_metrics(prs)
+    sparse = get_pr_metrics(prs, change_points=True)
+
+    assert carry_forward(sparse, "queue_older_than_7_days") == sorted(
+        row_key(m) for m in dense if m["name"] == "queue_older_than_7_days"
+    )
+    # only the gauges are stored as change points
+    assert [m for m in sparse if m["name"] == "prs_merged"] == [
+        m for m in dense if m["name"] == "prs_merged"
+    ]
+    assert len(sparse) < len(dense)
+
+
+def test_change_points_mark_drops_to_zero():
+    r = repo("an-org", "a-repo")
+    prs = [
+        pr(r, author="an-author", created_on=TWO_DAYS_AGO - ONE_WEEK, closed_on=TODAY),
+    ]
+
+    old_prs = [
+        (m["time"].date(), m["value"])
+        for m in get_pr_metrics(prs, change_points=True)
+        if m["name"] == "queue_older_than_7_days"
+    ]
+    assert old_prs == [(TWO_DAYS_AGO, 1), (TODAY, 0)]
+
+
+def carry_forward(metrics, name):
+    """
+    Carry each coordinate's value forward to every day up to today, dropping zeros, as
+    the *-locf.sql queries do
+    """
+    changes = {}
+    for m in metrics:
+        if m["name"] == name:
+            coord = row_key(m)[:-2]
+            changes.setdefault(coord, []).append((m["time"].date(), m["value"]))
+
+    rows = []
+    for coord, coord_changes in changes.items():
+        coord_changes.sort()
+        ends = [day for day, _ in coord_changes[1:]] + [TODAY + datetime.timedelta(1)]
+        for (day, value), end in zip(coord_changes, ends):
+            while value and day < end:
+                rows.append((*coord, day, value))
+                day += datetime.timedelta(days=1)
+    return sorted(rows)
+
+
+def row_key(m):
+    return (
+        m["organisation"],
+        m["repo"],
+        m["author"],
+        m["is_content"],
+        m["time"].date(),
+        m["value"],
+    )
+
+
+def varied_prs():
+    repos = [repo("an-org", "a-repo"), repo("another-org", "another-repo")]
+    authors = ["an-author", "another-author"]
+    start = TODAY - datetime.timedelta(days=30)
+    prs = []
+    for i in range(200):
+        created_on = start + datetime.timedelta(days=i % 29)
+        lifetime = datetime.timedelta(days=i % 17)
+        closed_on = created_on + lifetime if i % 3 else None
+        if closed_on and closed_on > TODAY:
+            closed_on = None
+        merged_on = closed_on if i % 2 else None
+        prs.append(
+            pr(
+                repos[i % 2],
+                created_on=created_on,
+                closed_on=closed_on,
+                merged_on=merged_on,
+                author=authors[i % 5 % 2],
+                is_content=i % 7 == 0,
+            )
+        )
+    return prs
+
+
 def repo(org, name, is_archived=False):
     return Repo(
         org,
@@ -0,0 +1,138 @@
+import concurrent.futures
+import datetime
+import time
+
+from metrics.github import query
+
+
+class FakeClient:
+    def __init__(self, pages, follow_ups):
+        self.pages = pages
+        self.follow_ups = follow_ups
+        self.queries = []
+
+    def graphql_query_pages(self, query, paths, **kwargs):
+        self.queries.append((query, kwargs))
+        return {alias: self.pages[kwargs[alias]] for alias in paths}
+
+    def graphql_query(self, query, path, cursor, org, repo):
+        self.queries.append((query, {"org": org, "repo": repo, "cursor": cursor}))
+        return iter(self.follow_ups[repo])
+
+
+def page(nodes, end_cursor=None):
+    return {
+        "nodes": nodes,
+        "pageInfo": {"endCursor": end_cursor, "hasNextPage": end_cursor is not None},
+    }
+
+
+def test_fetches_first_pages_of_repos_in_one_query(monkeypatch):
+    client = FakeClient({"repo-a": page([1, 2]), "repo-b": page([3])}, {})
+    monkeypatch.setattr(query, "_client", lambda: client)
+
+    assert query.prs_for_repos("an-org", ["repo-a", "repo-b"]) == [[1, 2], [3]]
+
+    [(document, variables)] = client.queries
+    assert "repo0: repository(name: $repo0)" in document
+    assert "repo1: repository(name: $repo1)" in document
+    assert variables == {"org": "an-org", "repo0": "repo-a", "repo1": "repo-b"}
+
+
+def test_follows_up_repos_with_more_pages(monkeypatch):
+    client = FakeClient(
+        {"repo-a": page([1, 2], end_cursor="the-cursor"), "repo-b": page([3])},
+        {"repo-a": [4, 5]},
+    )
+    monkeypatch.setattr(query, "_client", lambda: client)
+
+    assert query.issues_for_repos("an-org", ["repo-a", "repo-b"]) == [[1, 2, 4, 5], [3]]
+
+    _, (_, follow_up_variables) = client.queries
+    assert follow_up_variables == {
+        "org": "an-org",
+        "repo": "repo-a",
+        "cursor": "the-cursor",
+    }
+
+
+def test_fetches_nothing_for_no_repos(monkeypatch):
+    client = FakeClient({}, {})
+    monkeypatch.setattr(query, "_client", lambda: client)
+
+    assert query.vulnerabilities_for_repos("an-org", []) == []
+    assert client.queries == []
+
+
+class FakeSearchClient:
+    """
+    Searches a list of (updated, node) pairs, returning every match on one page
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.searches = []
+
+    def graphql_query_page(self, document, cursor, org, search):
+        self.searches.append(search)
+        start, end = search.split("updated:")[1].split("..")
+        matches = [node for updated, node in self.nodes if start <= updated <= end]
+        return {
+            "search": {
+                "issueCount": len(matches),
+                "nodes": matches[: query.SEARCH_LIMIT],
+                "pageInfo": {"endCursor": None, "hasNextPage": False},
+            }
+        }
+
+
+def test_searches_for_updated_prs_in_org(monkeypatch, freezer):
+    freezer.move_to("2023-06-10T12:00:00Z")
+    client = FakeSearchClient([("2023-06-10T11:00:00Z", {"number": 1})])
+    monkeypatch.setattr(query, "_client", lambda: client)
+
+    since = datetime.datetime(2023, 6, 9, 12, 0, 0, 500, tzinfo=datetime.UTC)
+    assert list(query.prs_updated_in_org("an-org", since)) == [{"number": 1}]
+    assert client.searches == [
+        "org:an-org is:pr updated:2023-06-09T12:00:00Z..2023-06-10T12:00:00Z"
+    ]
+
+
+def test_splits_searches_with_too_many_results(monkeypatch, freezer):
+    freezer.move_to("2023-06-10T00:00:00Z")
+    monkeypatch.setattr(query, "SEARCH_LIMIT", 2)
+    nodes = [
+        (f"2023-06-0{day}T00:00:00Z", {"number": day}) for day in [1, 2, 3, 4, 5, 6]
+    ]
+    client = FakeSearchClient(nodes)
+    monkeypatch.setattr(query, "_client", lambda: client)
+
+    since = datetime.datetime(2023, 6, 1, tzinfo=datetime.UTC)
+    prs = list(query.prs_updated_in_org("an-org", since))
+
+    assert sorted(pr["number"] for pr in prs) == [1, 2, 3, 4, 5, 6]
+    assert len(client.searches) > 1
+
+
+def test_tasks_on_different_threads_share_a_client(monkeypatch):
+    for name in [
+        "GITHUB_EBMDATALAB_TOKEN",
+        "GITHUB_OS_CORE_TOKEN",
+        "GITHUB_OS_TOKEN",
+    ]:
+        monkeypatch.setenv(name, "a-token")
+    monkeypatch.delenv("GITHUB_CACHE_PATH", raising=False)
+    monkeypatch.delenv("GITHUB_CHECKPOINT_PATH", raising=False)
+
+    def slow_client(**kwargs):
+        time.sleep(0.05)
+        return object()
+
+    monkeypatch.setattr(query, "GitHubClient", slow_client)
+    query._make_client.cache_clear()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        clients = list(executor.map(lambda _: query._client(), range(4)))
+    query._make_client.cache_clear()
+
+    assert all(client is clients[0] for client in clients)
@@ -2,6 +2,7 @@ import datetime
 
 from metrics.github import security
 from metrics.github.github import Repo
+from metrics.tools.dates import iter_days
 
 
 def test_vulnerability_open_on():
@@ -75,7 +76,10 @@ def test_vulnerabilities(monkeypatch):
 
     monkeypatch.setattr(security.github, "tech_repos", fake_repos)
 
-    def fake_vulnerabilities(org, repo):
+    def fake_vulnerabilities_for_repos(org, repos):
+        return [vulnerabilities() for _ in repos]
+
+    def vulnerabilities():
         return [
             {
                 "createdAt": "2023-10-13T00:00:00Z",
@@ -109,7 +113,9 @@ def test_vulnerabilities(monkeypatch):
             },
         ]
 
-    monkeypatch.setattr(security.query, "vulnerabilities", fake_vulnerabilities)
+    monkeypatch.setattr(
+        security.query, "vulnerabilities_for_repos", fake_vulnerabilities_for_repos
+    )
 
     result = security.vulnerabilities(datetime.date(2023, 10, 29))
 
@@ -141,3 +147,115 @@ def test_vulnerabilities(monkeypatch):
         "repo": "test2",
         "has_alerts_enabled": True,
     }
+
+
+def test_daily_counts_match_per_day_checks():
+    start = datetime.date(2023, 10, 1)
+    vulns = []
+    for i in range(60):
+        created_on = start + datetime.timedelta(days=i % 13)
+        closed_on = created_on + datetime.timedelta(days=i % 7 - 1)
+        closures = [None, None, None]
+        if i % 4:
+            closures[i % 3] = closed_on
+        vulns.append(security.Vulnerability(created_on, *closures))
+
+    # start the series after some vulns have been created and closed
+    first_day = start + datetime.timedelta(days=3)
+    last_day = start + datetime.timedelta(days=30)
+
+    assert list(security.daily_counts(vulns, first_day, last_day)) == [
+        (
+            day,
+            sum(1 for v in vulns if v.is_open_on(day)),
+            sum(1 for v in vulns if v.is_closed_on(day)),
+        )
+        for day in iter_days(first_day, last_day)
+    ]
+
+
+def test_vulnerabilities_change_points(monkeypatch):
+    repo = Repo("test-org", "test", "a-team", datetime.date(2023, 10, 13), False, True)
+    monkeypatch.setattr(security.github, "tech_repos", lambda: [repo])
+
+    def fake_vulnerabilities_for_repos(org, repos):
+        return [
+            [
+                {
+                    "createdAt": "2023-10-15T00:00:00Z",
+                    "fixedAt": "2023-10-20T00:00:00Z",
+                    "dismissedAt": None,
+                    "autoDismissedAt": None,
+                },
+            ]
+        ]
+
+    monkeypatch.setattr(
+        security.query, "vulnerabilities_for_repos", fake_vulnerabilities_for_repos
+    )
+
+    result = security.vulnerabilities(datetime.date(2023, 10, 29), change_points=True)
+
+    assert [(r["time"], r["open"], r["closed"]) for r in result] == [
+        (datetime.date(2023, 10, 13), 0, 0),
+        (datetime.date(2023, 10, 15), 1, 0),
+        (datetime.date(2023, 10, 20), 0, 1),
+    ]
+
+
+def test_vulnerabilities_from_org_alerts_match_per_repo_queries(monkeypatch):
+    repos = [
+        Repo("test-org", "test", "a-team", datetime.date(2023, 10, 13), False, True),
+        Repo("test-org", "test2", "a-team", datetime.date(2023, 10, 13), False, True),
+    ]
+    monkeypatch.setattr(security.github, "tech_repos", lambda: repos)
+
+    nodes = {
+        "test": [
+            {
+                "createdAt": "2023-10-13T00:00:00Z",
+                "fixedAt": "2023-10-20T00:00:00Z",
+                "dismissedAt": None,
+                "autoDismissedAt": None,
+            },
+        ],
+        "test2": [
+            {
+                "createdAt": "2023-10-15T00:00:00Z",
+                "fixedAt": None,
+                "dismissedAt": None,
+                "autoDismissedAt": "2023-10-22T00:00:00Z",
+            },
+        ],
+    }
+    monkeypatch.setattr(
+        security.query,
+        "vulnerabilities_for_repos",
+        lambda org, repos: [nodes[repo] for repo in repos],
+    )
+
+    fetched_orgs = []
+
+    def fake_dependabot_alerts(org):
+        fetched_orgs.append(org)
+        alerts = [
+            {
+                "repository": {"name": name},
+                "created_at": node["createdAt"],
+                "fixed_at": node["fixedAt"],
+                "dismissed_at": node["dismissedAt"],
+                "auto_dismissed_at": node["autoDismissedAt"],
+            }
+            for name, repo_nodes in nodes.items()
+            for node in repo_nodes
+        ]
+        # alerts for repos that aren't tech repos are ignored
+        return alerts + [dict(alerts[0], repository={"name": "not-a-tech-repo"})]
+
+    monkeypatch.setattr(security.query, "dependabot_alerts", fake_dependabot_alerts)
+
+    to_date = datetime.date(2023, 10, 29)
+    assert security.vulnerabilities(
+        to_date, org_alerts=True
+    ) == security.vulnerabilities(to_date)
+    assert fetched_orgs == ["test-org"]
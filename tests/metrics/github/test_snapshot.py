@@ -0,0 +1,80 @@
+import pytest
+
+from metrics.github import snapshot
+
+
+def test_records_and_replays_results(tmp_path, monkeypatch, freezer):
+    freezer.move_to("2023-06-10")
+    monkeypatch.setenv("GITHUB_SNAPSHOT_DIR", str(tmp_path))
+
+    calls = []
+
+    @snapshot.recorded("teams")
+    def fetch(org, team):
+        calls.append((org, team))
+        yield {"name": f"{team}-member"}
+
+    assert fetch("an-org", "a-team") == [{"name": "a-team-member"}]
+    assert (tmp_path / "2023-06-10" / "teams" / "an-org" / "a-team.jsonl.gz").exists()
+
+    monkeypatch.delenv("GITHUB_SNAPSHOT_DIR")
+    monkeypatch.setenv("GITHUB_FROM_SNAPSHOT", str(tmp_path / "2023-06-10"))
+
+    assert fetch("an-org", "a-team") == [{"name": "a-team-member"}]
+    assert calls == [("an-org", "a-team")]
+
+
+def test_records_and_replays_results_per_repo(tmp_path, monkeypatch, freezer):
+    freezer.move_to("2023-06-10")
+    monkeypatch.setenv("GITHUB_SNAPSHOT_DIR", str(tmp_path))
+
+    @snapshot.recorded_per_repo("prs")
+    def fetch(org, repos):
+        return [[{"repo": repo, "number": i} for i in range(2)] for repo in repos]
+
+    expected = fetch("an-org", ["repo-a", "repo-b"])
+
+    monkeypatch.delenv("GITHUB_SNAPSHOT_DIR")
+    monkeypatch.setenv("GITHUB_FROM_SNAPSHOT", str(tmp_path / "2023-06-10"))
+
+    # the repos can be replayed in different batches from the ones they were fetched in
+    assert fetch("an-org", ["repo-b"]) == [expected[1]]
+    assert fetch("an-org", ["repo-a", "repo-b"]) == expected
+
+
+def test_records_a_run_in_the_day_it_started(tmp_path, monkeypatch, freezer):
+    freezer.move_to("2023-06-10 23:59:59")
+    monkeypatch.setenv("GITHUB_SNAPSHOT_DIR", str(tmp_path))
+
+    @snapshot.recorded("repos")
+    def fetch(org):
+        return [{"name": f"{org}-repo"}]
+
+    fetch("an-org")
+    freezer.move_to("2023-06-11 00:00:01")
+    fetch("another-org")
+
+    assert [path.name for path in tmp_path.iterdir()] == ["2023-06-10"]
+    assert (tmp_path / "2023-06-10" / "repos" / "another-org.jsonl.gz").exists()
+
+
+def test_does_not_record_without_snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    @snapshot.recorded("repos")
+    def fetch(org):
+        return iter([{"name": "a-repo"}])
+
+    assert fetch("an-org") == [{"name": "a-repo"}]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_replaying_missing_results_fails(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITHUB_FROM_SNAPSHOT", str(tmp_path))
+
+    @snapshot.recorded("repos")
+    def fetch(org):  # pragma: no cover
+        return []
+
+    with pytest.raises(FileNotFoundError):
+        fetch("an-org")
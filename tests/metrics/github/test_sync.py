@@ -0,0 +1,238 @@
+import datetime
+
+from metrics.github import metrics, sync
+from metrics.github.github import PR, Repo
+from metrics.timescaledb import tables
+
+
+T1 = datetime.datetime(2023, 6, 1, tzinfo=datetime.UTC)
+T2 = datetime.datetime(2023, 6, 2, tzinfo=datetime.UTC)
+T3 = datetime.datetime(2023, 6, 3, tzinfo=datetime.UTC)
+
+
+def test_fetches_only_prs_updated_since_watermark(monkeypatch, freezer):
+    freezer.move_to(T3)
+    stored = [
+        row("repo-a", 1, updated_at=T1),
+        row("repo-a", 2, updated_at=T2),
+        row("repo-b", 3, updated_at=T1),
+    ]
+    monkeypatch.setattr(sync.db, "read", lambda table, **filters: stored)
+    upserted = fake_upsert(monkeypatch)
+
+    fetched = {
+        "repo-a": [node(2, updated_at=T3, closed_at=T3)],
+        "repo-b": [],
+        "repo-c": [],
+    }
+    watermarks = {}
+
+    def fake_prs_updated_since(org, repo, since):
+        watermarks[repo] = since
+        return fetched[repo]
+
+    monkeypatch.setattr(sync.query, "prs_updated_since", fake_prs_updated_since)
+
+    repo_a, repo_b, repo_c = sync.prs_for_repos(
+        "an-org", ["repo-a", "repo-b", "repo-c"]
+    )
+
+    assert watermarks == {"repo-a": T2, "repo-b": T1, "repo-c": None}
+    assert upserted[tables.GitHubPullRequestStore] == [
+        row("repo-a", 2, updated_at=T3, closed_at=T3)
+    ]
+    assert repo_a == [node(1), node(2, closed_at=T3)]
+    assert repo_b == [node(3)]
+    assert repo_c == []
+    assert upserted[tables.GitHubPullRequestSyncs] == [
+        synced("repo-a", T3),
+        synced("repo-b", T3),
+        synced("repo-c", T3),
+    ]
+
+
+def test_upserts_each_pr_once_when_it_comes_back_twice(monkeypatch):
+    monkeypatch.setattr(sync.db, "read", lambda table, **filters: [])
+    upserted = fake_upsert(monkeypatch)
+
+    # PR 3 was updated while we were paging, so PR 2 came back on the next page too
+    nodes = [node(3, updated_at=T3), node(2, updated_at=T2), node(2, updated_at=T2)]
+    monkeypatch.setattr(sync.query, "prs_updated_since", lambda org, repo, since: nodes)
+
+    (repo_a,) = sync.prs_for_repos("an-org", ["repo-a"])
+
+    assert upserted[tables.GitHubPullRequestStore] == [
+        row("repo-a", 3, updated_at=T3),
+        row("repo-a", 2, updated_at=T2),
+    ]
+    assert repo_a == [node(3), node(2)]
+
+
+def test_stored_times_are_converted_to_utc(monkeypatch):
+    # a PR created late in the evening in UTC, read back in a session that's ahead
+    late = datetime.datetime(2023, 6, 1, 23, 30, tzinfo=datetime.UTC)
+    ahead = datetime.timezone(datetime.timedelta(hours=2))
+    stored = row("repo-a", 1, updated_at=T1) | {"created_at": late.astimezone(ahead)}
+    monkeypatch.setattr(sync.db, "read", lambda table, **filters: [stored])
+    monkeypatch.setattr(sync.db, "upsert", lambda table, rows: list(rows))
+    monkeypatch.setattr(sync.query, "prs_updated_since", lambda org, repo, since: [])
+
+    ((pr,),) = sync.prs_for_repos("an-org", ["repo-a"])
+
+    assert pr["createdAt"] == late.isoformat()
+
+
+def fake_upsert(monkeypatch):
+    upserted = {}
+    monkeypatch.setattr(
+        sync.db,
+        "upsert",
+        lambda table, rows: upserted.setdefault(table, []).extend(rows),
+    )
+    return upserted
+
+
+def synced(repo, synced_at):
+    return {"organisation": "an-org", "repo": repo, "synced_at": synced_at}
+
+
+def row(repo, number, updated_at, closed_at=None):
+    return {
+        "organisation": "an-org",
+        "repo": repo,
+        "number": number,
+        "author": "an-author",
+        "created_at": T1,
+        "closed_at": closed_at,
+        "merged_at": None,
+        "updated_at": updated_at,
+    }
+
+
+def node(number, updated_at=None, closed_at=None):
+    node = {
+        "author": {"login": "an-author"},
+        "number": number,
+        "createdAt": T1.isoformat(),
+        "closedAt": closed_at.isoformat() if closed_at else None,
+        "mergedAt": None,
+    }
+    if updated_at:
+        node["updatedAt"] = updated_at.isoformat()
+    return node
+
+
+class FakeMetricsTable:
+    def __init__(self, rows):
+        self.rows = {key(row): row for row in rows}
+
+    def latest_times(self, table, *columns):
+        latest = {}
+        for row in self.rows.values():
+            group = tuple(row[c] for c in columns)
+            latest[group] = max(latest.get(group, row["time"]), row["time"])
+        return latest
+
+    def read(self, table, time):
+        return [row for row in self.rows.values() if row["time"] in time]
+
+    def upsert(self, table, rows):
+        self.rows.update((key(row), row) for row in rows)
+
+    def delete_rows(self, table, rows):
+        for row in rows:
+            del self.rows[key(row)]
+
+
+def key(row):
+    return tuple((k, v) for k, v in sorted(row.items()) if k != "value")
+
+
+def test_update_metrics_matches_recomputing_everything(monkeypatch, freezer):
+    freezer.move_to("2023-06-10")
+    repo = Repo("an-org", "a-repo", "a-team", datetime.date.min)
+    created_on = datetime.date(2023, 5, 1)
+    prs = [
+        PR(repo, "an-author", created_on, None, None, False),
+        PR(repo, "another-author", created_on, None, None, False),
+    ]
+    fake = FakeMetricsTable(metrics.get_pr_metrics(prs))
+    for name in ["latest_times", "read", "upsert", "delete_rows"]:
+        monkeypatch.setattr(sync.db, name, getattr(fake, name))
+
+    # one of the PRs is merged later that day, so it wasn't old on that day after all
+    freezer.move_to("2023-06-11")
+    merged_on = datetime.date(2023, 6, 10)
+    prs[1] = PR(repo, "another-author", created_on, merged_on, merged_on, False)
+
+    removed = {
+        "time": datetime.datetime.combine(merged_on, datetime.time()),
+        "name": "queue_older_than_7_days",
+        "organisation": "an-org",
+        "repo": "a-repo",
+        "author": "another-author",
+        "is_content": False,
+    }
+    assert key(removed | {"value": 1}) in fake.rows
+
+    sync.update_metrics(None, lambda since: metrics.get_pr_metrics(prs, since), "value")
+
+    assert key(removed | {"value": 1}) not in fake.rows
+    assert sorted(fake.rows.values(), key=key) == sorted(
+        metrics.get_pr_metrics(prs), key=key
+    )
+
+
+def test_searches_org_for_prs_in_synced_repos(monkeypatch, freezer):
+    freezer.move_to(T3)
+    monkeypatch.setenv("INCREMENTAL_SYNC_SEARCH", "t")
+    stored = [row("repo-a", 1, updated_at=T1), row("repo-c", 3, updated_at=T1)]
+    monkeypatch.setattr(
+        sync.db,
+        "read",
+        lambda table, organisation, repo: [r for r in stored if r["repo"] in repo],
+    )
+    upserted = fake_upsert(monkeypatch)
+
+    # repo-c's sync is behind repo-a's, say because a run failed part way through
+    monkeypatch.setattr(
+        sync.db,
+        "latest_times",
+        lambda table, *columns, time_column: {
+            ("an-org", "repo-a"): T2,
+            ("an-org", "repo-c"): T1,
+            ("an-org", "not-a-tech-repo"): T1 - datetime.timedelta(days=30),
+        },
+    )
+
+    searches = []
+
+    def fake_prs_updated_in_org(org, since):
+        searches.append(since)
+        return [
+            node(2, updated_at=T3) | {"repository": {"name": "repo-a"}},
+            node(4, updated_at=T3) | {"repository": {"name": "not-a-tech-repo"}},
+        ]
+
+    monkeypatch.setattr(sync.query, "prs_updated_in_org", fake_prs_updated_in_org)
+    monkeypatch.setattr(
+        sync.query,
+        "prs_updated_since",
+        lambda org, repo, since: [node(5, updated_at=T3)] if repo == "repo-b" else [],
+    )
+
+    repos = [Repo("an-org", f"repo-{x}", "a-team", T1.date()) for x in "abc"]
+    sync.prepare(repos)
+    repo_a, repo_b = sync.prs_for_repos("an-org", ["repo-a", "repo-b"])
+    (repo_c,) = sync.prs_for_repos("an-org", ["repo-c"])
+
+    assert repo_a == [node(1), node(2)]
+    assert repo_b == [node(5)]  # never synced, so fetched in full
+    assert repo_c == [node(3)]
+    # searched once, from a little before the earliest sync of the repos
+    assert searches == [T1 - sync.SEARCH_LAG]
+    assert upserted[tables.GitHubPullRequestSyncs] == [
+        synced("repo-a", T3),
+        synced("repo-b", T3),
+        synced("repo-c", T3),
+    ]
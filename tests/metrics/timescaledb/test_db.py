@@ -1,7 +1,18 @@
 import datetime
 
+import psycopg
 import pytest
-from sqlalchemy import TIMESTAMP, Column, Table, Text, create_engine, select, text
+from sqlalchemy import (
+    TIMESTAMP,
+    Column,
+    Integer,
+    Table,
+    Text,
+    create_engine,
+    inspect,
+    select,
+    text,
+)
 from sqlalchemy_utils import create_database, database_exists, drop_database
 
 from metrics.timescaledb import db, tables
@@ -38,6 +49,18 @@ def get_rows(engine, table):
         return connection.execute(select(table)).all()
 
 
+@pytest.fixture
+def timescaledb(engine):
+    # Some tests check TimescaleDB's own behaviour, such as continuous aggregates and
+    # compression, so they need the real extension, which CI's database has
+    with engine.connect() as connection:
+        installed = connection.scalar(
+            text("SELECT count(*) FROM pg_extension WHERE extname = 'timescaledb'")
+        )
+    if not installed:  # pragma: no cover
+        pytest.skip("needs the TimescaleDB extension")
+
+
 def assert_is_hypertable(connection, engine, table):
     # check there are timescaledb child tables
     # https://stackoverflow.com/questions/1461722/how-to-find-child-tables-that-inherit-from-another-table-in-psql
@@ -78,6 +101,30 @@ def hypertable(request):
     )
 
 
+@pytest.fixture
+def aggregated_hypertable(request):
+    name = f"{request.function.__name__}_hypertable"
+    return Table(
+        name,
+        tables.metadata,
+        Column("time", TIMESTAMP(timezone=True), primary_key=True),
+        Column("name", Text, primary_key=True),
+        Column("value", Integer),
+        info={"weekly_aggregate": {"name": f"{name}_weekly", "value": "value"}},
+    )
+
+
+def get_weekly_rows(engine, table):
+    aggregate = table.info["weekly_aggregate"]["name"]
+    with engine.connect() as connection:
+        return connection.execute(
+            text(
+                "SELECT bucket, name, last_value, last_day, total "
+                f"FROM {aggregate} ORDER BY bucket, name"
+            )
+        ).all()
+
+
 def test_ensure_table(engine, table):
     with engine.begin() as connection:
         assert not db._has_table(connection, table)
@@ -93,6 +140,71 @@ def test_ensure_hypertable(engine, hypertable):
         assert_is_hypertable(connection, engine, hypertable)
 
 
+def test_ensure_hypertable_with_settings(engine, timescaledb, hypertable):
+    hypertable.info["hypertable"] = {
+        "chunk_time_interval": datetime.timedelta(days=90),
+        "compress_segmentby": ["value"],
+        "compress_after": "180 days",
+    }
+
+    with engine.begin() as connection:
+        db._ensure_table(connection, hypertable)
+        db._ensure_table(connection, hypertable)
+
+    with engine.connect() as connection:
+        interval = connection.scalar(
+            text(
+                "SELECT time_interval FROM timescaledb_information.dimensions "
+                "WHERE hypertable_name = :name"
+            ),
+            {"name": hypertable.name},
+        )
+        compressed = connection.scalar(
+            text(
+                "SELECT compression_enabled FROM timescaledb_information.hypertables "
+                "WHERE hypertable_name = :name"
+            ),
+            {"name": hypertable.name},
+        )
+        policies = connection.scalar(
+            text(
+                "SELECT count(*) FROM timescaledb_information.jobs "
+                "WHERE hypertable_name = :name AND proc_name = 'policy_compression'"
+            ),
+            {"name": hypertable.name},
+        )
+
+    assert interval == datetime.timedelta(days=90)
+    assert compressed
+    # old chunks are compressed when the table is replaced, rather than by a policy
+    assert policies == 0
+
+
+def test_replace_compresses_old_chunks(engine, timescaledb, hypertable):
+    hypertable.info["hypertable"] = {
+        "compress_segmentby": ["value"],
+        "compress_after": "180 days",
+    }
+    old = datetime.datetime(2020, 4, 2, tzinfo=datetime.UTC)
+    new = datetime.datetime.now(tz=datetime.UTC).replace(microsecond=0)
+    rows = [{"time": old, "value": "old"}, {"time": new, "value": "new"}]
+
+    db.replace_table(hypertable, rows)
+
+    with engine.connect() as connection:
+        chunks = connection.execute(
+            text(
+                "SELECT range_end <= :new, is_compressed "
+                "FROM timescaledb_information.chunks "
+                "WHERE hypertable_name = :name ORDER BY range_start"
+            ),
+            {"name": hypertable.name, "new": new},
+        ).all()
+
+    assert chunks == [(True, True), (False, False)]
+    assert sorted(get_rows(engine, hypertable)) == [(old, "old"), (new, "new")]
+
+
 def test_get_url(monkeypatch):
     monkeypatch.setenv("TIMESCALEDB_URL", "postgresql://test/db")
 
@@ -166,6 +278,25 @@ def test_write(engine, table):
     assert len(rows) == 3
 
 
+def test_write_escapes_values(engine, table):
+    with engine.begin() as connection:
+        db._ensure_table(connection, table)
+
+    values = ["tab\there", "new\nline", "back\\slash", "\\N"]
+    db.write(table, [{"value": v} for v in values])
+
+    assert sorted(r[0] for r in get_rows(engine, table)) == sorted(values)
+
+
+def test_upsert_with_reserved_column_name(engine, table):
+    table.append_column(Column("user", Text))
+
+    db.upsert(table, [{"value": "1", "user": "a"}])
+    db.upsert(table, [{"value": "1", "user": "b"}, {"value": "2", "user": None}])
+
+    assert sorted(get_rows(engine, table)) == [("1", "b"), ("2", None)]
+
+
 def test_upsert(engine, table):
     # add a non-PK column to the table
     table.append_column(Column("value2", Text))
@@ -190,3 +321,309 @@ def test_upsert(engine, table):
     # check upsert modifies matched row 3 and new rows 4-5
     modified_rows = [r for r in rows if int(r[0]) >= 3]
     assert modified_rows == [("3", "b"), ("4", "b"), ("5", "b")]
+
+
+def test_upsert_only_writes_changed_rows(engine, table):
+    table.append_column(Column("value2", Text))
+    db.upsert(table, [{"value": "1", "value2": "a"}, {"value": "2", "value2": None}])
+
+    def row_versions():
+        with engine.connect() as connection:
+            return dict(
+                connection.execute(text(f"SELECT value, xmin FROM {table}")).all()
+            )
+
+    before = row_versions()
+    counts = db.upsert(
+        table,
+        [
+            {"value": "1", "value2": "a"},
+            {"value": "2", "value2": "b"},
+            {"value": "3", "value2": "c"},
+        ],
+    )
+
+    assert counts == db.UpsertCounts(inserted=1, updated=1, unchanged=1)
+    after = row_versions()
+    assert after["1"] == before["1"]
+    assert after["2"] != before["2"]
+    assert get_rows(engine, table) == [("1", "a"), ("2", "b"), ("3", "c")]
+
+
+def test_upsert_ensures_table_once(engine, table, monkeypatch):
+    ensured = []
+    ensure_table = db._ensure_table
+
+    def spy(connection, table):
+        ensured.append(table.name)
+        ensure_table(connection, table)
+
+    monkeypatch.setattr(db, "_ensure_table", spy)
+
+    db.upsert(table, [{"value": "a"}])
+    db.upsert(table, [{"value": "b"}])
+    assert ensured == [table.name]
+
+    db.replace_table(table, [{"value": "c"}])
+    ensured.clear()
+    db.upsert(table, [{"value": "d"}])
+    assert ensured == [table.name]
+    assert get_rows(engine, table) == [("c",), ("d",)]
+
+
+def test_read(engine, table):
+    table.append_column(Column("value2", Text))
+    rows = [{"value": str(i), "value2": "a" if i < 3 else "b"} for i in range(1, 5)]
+    db.upsert(table, rows)
+
+    assert sorted(r["value"] for r in db.read(table, value2="a")) == ["1", "2"]
+    assert sorted(r["value"] for r in db.read(table, value=["1", "4"])) == ["1", "4"]
+
+
+def test_read_missing_table(engine, table):
+    assert db.read(table) == []
+
+
+def test_replace_table(engine, table):
+    db.replace_table(table, [{"value": "a"}, {"value": "b"}])
+    db.replace_table(table, [{"value": "c"}])
+
+    assert get_rows(engine, table) == [("c",)]
+
+    with engine.connect() as connection:
+        assert not inspect(connection).has_table(f"{table.name}_shadow")
+        assert not inspect(connection).has_table(f"{table.name}_old")
+        pk = inspect(connection).get_pk_constraint(table.name)
+        assert pk["name"] == f"{table.name}_pkey"
+
+
+def test_replace_table_after_failed_run(engine, table):
+    db.replace_table(table, [{"value": "a"}])
+
+    # a run that fails while loading the shadow table leaves it behind
+    with pytest.raises(ValueError):
+        db.replace_table(table, fail_after([{"value": "b"}]))
+    assert get_rows(engine, table) == [("a",)]
+
+    db.replace_table(table, [{"value": "c"}])
+    assert get_rows(engine, table) == [("c",)]
+
+
+def test_replace_hypertable(engine, hypertable):
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    rows = [
+        {"time": start + datetime.timedelta(weeks=i), "value": str(i)}
+        for i in range(10)
+    ]
+    db.replace_table(hypertable, rows)
+    db.replace_table(hypertable, rows[:2])
+
+    with engine.connect() as connection:
+        assert_is_hypertable(connection, engine, hypertable)
+    assert len(get_rows(engine, hypertable)) == 2
+
+
+# Weeks start on Saturdays (see db.WEEK_ORIGIN)
+SATURDAY = datetime.datetime(2020, 4, 4, tzinfo=datetime.UTC)
+NEXT_SATURDAY = SATURDAY + datetime.timedelta(weeks=1)
+
+
+def test_weekly_aggregate(engine, timescaledb, aggregated_hypertable):
+    table = aggregated_hypertable
+    db.upsert(
+        table,
+        [
+            {"time": SATURDAY, "name": "a", "value": 1},
+            {"time": SATURDAY + datetime.timedelta(days=2), "name": "a", "value": 2},
+            {"time": SATURDAY + datetime.timedelta(days=6), "name": "a", "value": 3},
+            {"time": NEXT_SATURDAY, "name": "a", "value": 5},
+            {"time": SATURDAY, "name": "b", "value": 4},
+        ],
+    )
+
+    assert get_weekly_rows(engine, table) == [
+        (SATURDAY, "a", 3, SATURDAY + datetime.timedelta(days=6), 6),
+        (SATURDAY, "b", 4, SATURDAY, 4),
+        (NEXT_SATURDAY, "a", 5, NEXT_SATURDAY, 5),
+    ]
+
+    db.upsert(table, [{"time": NEXT_SATURDAY, "name": "a", "value": 7}])
+
+    assert get_weekly_rows(engine, table)[-1] == (
+        NEXT_SATURDAY,
+        "a",
+        7,
+        NEXT_SATURDAY,
+        7,
+    )
+
+
+def test_weekly_aggregate_replaced(engine, timescaledb, aggregated_hypertable):
+    table = aggregated_hypertable
+    db.replace_table(
+        table,
+        [
+            {"time": SATURDAY, "name": "a", "value": 1},
+            {"time": NEXT_SATURDAY, "name": "a", "value": 2},
+        ],
+    )
+    db.replace_table(table, [{"time": SATURDAY, "name": "b", "value": 3}])
+
+    # the aggregate is of the new table, not the old one
+    assert get_weekly_rows(engine, table) == [(SATURDAY, "b", 3, SATURDAY, 3)]
+
+
+def test_parallel_replace(engine, hypertable, monkeypatch):
+    monkeypatch.setattr(db, "WRITE_WORKERS", 3)
+    monkeypatch.setattr(db, "WRITE_BATCH_SIZE", 2)
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    rows = [
+        {"time": start + datetime.timedelta(days=i), "value": str(i)} for i in range(50)
+    ]
+
+    db.replace_table(hypertable, rows)
+
+    assert sorted(get_rows(engine, hypertable)) == [
+        (r["time"], r["value"]) for r in rows
+    ]
+
+
+def test_parallel_replace_fails(engine, hypertable, monkeypatch):
+    monkeypatch.setattr(db, "WRITE_WORKERS", 3)
+    monkeypatch.setattr(db, "WRITE_BATCH_SIZE", 2)
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    rows = [
+        {"time": start + datetime.timedelta(days=i), "value": str(i)} for i in range(50)
+    ]
+    db.replace_table(hypertable, rows[:1])
+
+    # the rows fail
+    with pytest.raises(ValueError):
+        db.replace_table(hypertable, fail_after(rows))
+    assert get_rows(engine, hypertable) == [(start, "0")]
+
+    # one of the connections fails
+    with pytest.raises(psycopg.errors.UniqueViolation):
+        db.replace_table(hypertable, rows + rows[-1:])
+    assert get_rows(engine, hypertable) == [(start, "0")]
+
+
+def fail_after(rows):
+    yield from rows
+    raise ValueError
+
+
+def test_delete_rows(engine, table):
+    table.append_column(Column("value2", Text))
+    db.upsert(table, [{"value": str(i), "value2": "a"} for i in range(1, 4)])
+
+    db.delete_rows(table, [{"value": "1", "value2": "b"}, {"value": "3"}])
+
+    assert get_rows(engine, table) == [("2", "a")]
+
+
+def test_delete_rows_from_missing_table(engine, table):
+    db.delete_rows(table, [{"value": "1"}])
+
+
+def test_replace_range(engine, hypertable):
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    days = [start + datetime.timedelta(days=i) for i in range(5)]
+    db.upsert(hypertable, [{"time": day, "value": "old"} for day in days])
+
+    db.replace_range(hypertable, days[1], days[3], [{"time": days[2], "value": "new"}])
+
+    assert sorted(get_rows(engine, hypertable)) == [
+        (days[0], "old"),
+        (days[2], "new"),
+        (days[3], "old"),
+        (days[4], "old"),
+    ]
+
+
+def test_replace_range_drops_chunks(engine, timescaledb, hypertable):
+    # Chunks are a week long and line up with the Unix epoch, so they start on Thursdays
+    thursday = datetime.datetime(2020, 4, 2, tzinfo=datetime.UTC)
+    days = [thursday + datetime.timedelta(days=i) for i in range(21)]
+    db.upsert(hypertable, [{"time": day, "value": "old"} for day in days])
+
+    # the range covers the end of the first chunk, all of the second and the start of
+    # the third
+    start, end = days[3], days[17]
+    new_rows = [{"time": days[3], "value": "new"}, {"time": days[15], "value": "new"}]
+    db.replace_range(hypertable, start, end, new_rows)
+
+    assert sorted(get_rows(engine, hypertable)) == [
+        *[(day, "old") for day in days[:3]],
+        (days[3], "new"),
+        (days[15], "new"),
+        *[(day, "old") for day in days[17:]],
+    ]
+
+    with engine.connect() as connection:
+        chunk_starts = connection.scalars(
+            text(
+                "SELECT range_start FROM timescaledb_information.chunks "
+                "WHERE hypertable_name = :name ORDER BY range_start"
+            ),
+            {"name": hypertable.name},
+        ).all()
+    assert chunk_starts == [days[0], days[14]]
+
+
+def test_replace_range_with_filters(engine, hypertable):
+    hypertable.append_column(Column("group", Text))
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    days = [start + datetime.timedelta(days=i) for i in range(3)]
+    db.upsert(
+        hypertable,
+        [
+            {"time": day, "value": f"old {group}", "group": group}
+            for day in days
+            for group in ["a", "b"]
+        ],
+    )
+
+    db.replace_range(
+        hypertable,
+        days[1],
+        days[2],
+        [{"time": days[1], "value": "new a", "group": "a"}],
+        group="a",
+    )
+
+    assert sorted(get_rows(engine, hypertable)) == [
+        (days[0], "old a", "a"),
+        (days[0], "old b", "b"),
+        (days[1], "new a", "a"),
+        (days[1], "old b", "b"),
+        (days[2], "old a", "a"),
+        (days[2], "old b", "b"),
+    ]
+
+
+def test_latest_times(engine, hypertable):
+    hypertable.append_column(Column("group", Text))
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    rows = [
+        {"time": start + datetime.timedelta(days=i), "value": str(i), "group": group}
+        for i, group in enumerate(["a", "b", "a", "b", "b"])
+    ]
+    db.upsert(hypertable, rows)
+
+    assert db.latest_times(hypertable, "group") == {
+        ("a",): start + datetime.timedelta(days=2),
+        ("b",): start + datetime.timedelta(days=4),
+    }
+
+
+def test_latest_times_of_another_column(engine, table):
+    table.append_column(Column("updated_at", TIMESTAMP(timezone=True)))
+    start = datetime.datetime(2020, 4, 1, tzinfo=datetime.UTC)
+    db.upsert(table, [{"value": "a", "updated_at": start}])
+
+    assert db.latest_times(table, time_column="updated_at") == {(): start}
+
+
+def test_latest_times_of_missing_table(engine, hypertable):
+    assert db.latest_times(hypertable, "value") == {}
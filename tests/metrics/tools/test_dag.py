@@ -0,0 +1,62 @@
+import graphlib
+import threading
+
+import pytest
+
+from metrics.tools import dag
+
+
+def test_runs_tasks_after_their_dependencies():
+    ran = []
+    tasks = {name: lambda name=name: ran.append(name) for name in ["a", "b", "c"]}
+
+    outcomes = dag.run(tasks, {"b": ["a"], "c": ["b"]}, max_workers=3)
+
+    assert ran == ["a", "b", "c"]
+    assert outcomes == {"a": dag.OK, "b": dag.OK, "c": dag.OK}
+
+
+def test_runs_independent_tasks_concurrently():
+    # each task waits for the other, so this only finishes if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    tasks = {"a": barrier.wait, "b": barrier.wait}
+
+    assert dag.run(tasks, {}, max_workers=2) == {"a": dag.OK, "b": dag.OK}
+
+
+def test_skips_tasks_that_depend_on_failed_tasks():
+    def fail():
+        raise ValueError
+
+    ran = []
+    tasks = {
+        "a": fail,
+        "b": lambda: ran.append("b"),
+        "c": lambda: ran.append("c"),
+        "d": lambda: ran.append("d"),
+    }
+
+    outcomes = dag.run(tasks, {"b": ["a"], "c": ["b"]}, max_workers=2)
+
+    assert ran == ["d"]
+    assert outcomes == {
+        "a": dag.FAILED,
+        "b": dag.SKIPPED,
+        "c": dag.SKIPPED,
+        "d": dag.OK,
+    }
+
+
+def test_ignores_dependencies_on_unknown_tasks():
+    ran = []
+    outcomes = dag.run({"b": lambda: ran.append("b")}, {"b": ["a"]}, max_workers=1)
+
+    assert ran == ["b"]
+    assert outcomes == {"b": dag.OK}
+
+
+def test_rejects_cycles():
+    tasks = {"a": lambda: None, "b": lambda: None}
+
+    with pytest.raises(graphlib.CycleError):
+        dag.run(tasks, {"a": ["b"], "b": ["a"]}, max_workers=1)